@@ -52,6 +52,25 @@ def bbnorm(T, E):
     return bbn
 
 
+def bbnorm_v(Tv, E):
+    """
+    Normalized blackbody spectra for many temperatures at once, same as bbnorm for each of them.
+
+    Parameters:
+    Tv (numpy array): Temperatures in Kelvin, shape (n,).
+    E (numpy array): Array of energies in ergs.
+
+    Returns:
+    numpy array: Normalized blackbody spectra, shape (n, len(E)).
+    """
+    k = 1.3807e-16  # Boltzmann's constant in erg/K
+
+    bbe = 1.e20 * (E**3) / (np.exp(E / (k * np.asarray(Tv)[:, None])) - 1.)
+    bbint = np.sum(bbe[:, :-1] * np.diff(E), axis=1)
+
+    return bbe / bbint[:, None]
+
+
 
 def bbfrac(enlo, enhi, T):
     """
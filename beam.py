@@ -1,4 +1,8 @@
 import numpy as np
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 def sphdist(lon1, lat1, lon2, lat2):
     """
@@ -46,10 +50,8 @@ def beam_luminosity(nth, nphi, beams, floor, star_rot_ang):
     vth = -np.pi / 2 + np.linspace(0, np.pi, nth)
     vphi = np.linspace(0, 2 * np.pi, nphi)
 
-    # Apply rotation to the beam longitudes
-    for beam in beams:
-        beam.reset_longitude()  # Reset to original longitude before update
-        beam.update_longitude(star_rot_ang)
+    # Rotated beam longitudes; the Beam objects are left unchanged so that they can be shared
+    longs = [(beam.original_long + star_rot_ang) % (2 * np.pi) for beam in beams]
 
     # Calculate the solid angle covered by each point
     thstep = np.pi / (nth - 1)
@@ -60,10 +62,10 @@ def beam_luminosity(nth, nphi, beams, floor, star_rot_ang):
     beam_pattern = np.zeros((nth, nphi))
 
     # Calculate the spherical distances and beam patterns for each Beam object
-    for beam in beams:
+    for beam, long in zip(beams, longs):
         sph_dist = np.zeros((nth, nphi))
         for i in range(nth):
-            sph_dist[i, :] = sphdist(beam.long, beam.lat, vphi, vth[i])
+            sph_dist[i, :] = sphdist(long, beam.lat, vphi, vth[i])
         beam_contrib = beam.norm * np.exp(-((sph_dist - beam.th) ** 2) / (2 * beam.sigma ** 2))
         beam_pattern += beam_contrib
 
@@ -79,3 +81,444 @@ def beam_luminosity(nth, nphi, beams, floor, star_rot_ang):
     nlum = beam_pattern / beamint
 
     return vth, vphi, nlum
+
+
+class BeamSet:
+    """
+    Parameters of several beams stored as arrays (one entry per beam), so that all beams can be
+    evaluated at once by broadcasting. A BeamSet is immutable (read-only arrays, no attribute
+    assignment), so it can be shared between threads.
+    """
+    def __init__(self, long, lat, sigma, th, norm):
+        for name, value in (('long', long), ('lat', lat), ('sigma', sigma), ('th', th), ('norm', norm)):
+            value = np.array(np.atleast_1d(value), dtype=float)
+            value.setflags(write=False)
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('BeamSet is immutable, build a new one instead')
+
+    def rotated(self, star_rot_ang):
+        """Beams of the star rotated by star_rot_ang about its spin axis."""
+        return BeamSet((self.long + star_rot_ang) % (2 * np.pi), self.lat, self.sigma, self.th, self.norm)
+
+    @classmethod
+    def from_beams(cls, beams):
+        """
+        Collect a list of Beam objects (their original longitudes) or of beam parameter dictionaries.
+        """
+        if isinstance(beams, BeamSet):
+            return beams
+        if all(isinstance(beam, Beam) for beam in beams):
+            return cls([b.original_long for b in beams], [b.lat for b in beams], [b.sigma for b in beams],
+                       [b.th for b in beams], [b.norm for b in beams])
+        return cls(*([b[key] for b in beams] for key in ('long', 'lat', 'sigma', 'th', 'norm')))
+
+    def __len__(self):
+        return len(self.long)
+
+
+def sky_grid(nth, nphi):
+    """
+    Angle vectors and solid angle weights of the beam grid used by beam_luminosity.
+    :param nth: Number of theta divisions
+    :param nphi: Number of phi divisions
+    :return: vth, vphi and the solid angle of the points of each theta row (sang)
+    """
+    vth = -np.pi / 2 + np.linspace(0, np.pi, nth)
+    vphi = np.linspace(0, 2 * np.pi, nphi)
+
+    thstep = np.pi / (nth - 1)
+    phistep = 2 * np.pi / nphi
+    sang = thstep * phistep * np.abs(np.cos(vth))
+
+    return vth, vphi, sang
+
+
+def gaussian_patterns(vth, vphi, long, lat, sigma, th):
+    """
+    Gaussian profiles of unit norm on the (vth, vphi) grid.
+    :param vth: theta coordinates, (nth,)
+    :param vphi: phi coordinates, (nphi,)
+    :param long: Beam longitudes, shape (..., nbeam), e.g. one row per rotation of the star
+    :param lat, sigma, th: Beam parameters, (nbeam,)
+    :return: Profiles, shape (..., nbeam, nth, nphi)
+    """
+    # Spherical distances as in sphdist; the latitude terms only depend on the beam and theta,
+    # the longitude term only on the longitude and phi
+    lat = lat[:, None]
+    a_lat = np.sin((vth[None, :] - lat) / 2) ** 2
+    coslat = np.cos(lat) * np.cos(vth[None, :])
+    a_lon = np.sin((vphi - long[..., None]) / 2) ** 2
+    a = a_lat[:, :, None] + coslat[:, :, None] * a_lon[..., None, :]
+    sph_dist = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return np.exp(-((sph_dist - th[:, None, None]) ** 2) / (2 * sigma[:, None, None] ** 2))
+
+
+def beam_luminosity_all(nth, nphi, beams, floor, star_rot_angs):
+    """
+    Generate the beam pattern for every rotation of the star in one vectorized pass.
+    Each slice is the same as beam_luminosity for that rotation angle.
+    :param nth: Number of theta divisions
+    :param nphi: Number of phi divisions
+    :param beams: BeamSet, or list of Beam objects or beam parameter dictionaries
+    :param floor: Minimum value of the beam pattern
+    :param star_rot_angs: Rotational angles of the star, shape (nang,)
+    :return: theta (vth), phi (vphi) coordinates and the normalized luminosity patterns (nlum), shape (nang, nth, nphi)
+    """
+    beams = BeamSet.from_beams(beams)
+    star_rot_angs = np.atleast_1d(np.asarray(star_rot_angs, dtype=float))
+    vth, vphi, sang = sky_grid(nth, nphi)
+
+    # Rotated beam longitudes, shape (nang, nbeam)
+    long = (beams.long[None, :] + star_rot_angs[:, None]) % (2 * np.pi)
+
+    # Sum the Gaussian profiles of all beams and add the floor value
+    profiles = gaussian_patterns(vth, vphi, long, beams.lat, beams.sigma, beams.th)
+    beam_pattern = np.sum(beams.norm[None, :, None, None] * profiles, axis=1)
+    beam_pattern += floor
+
+    # Normalize every pattern by its integral to create the luminosity patterns
+    beamint = np.sum(beam_pattern * sang[:, None], axis=(1, 2))
+    nlum = beam_pattern / beamint[:, None, None]
+
+    return vth, vphi, nlum
+
+
+def beam_support(vth, vphi, lat, dmax):
+    """
+    Grid points that may lie within dmax of a beam axis at latitude lat and longitude 0.
+    :param vth: theta coordinates, (nth,)
+    :param vphi: phi coordinates, (nphi,), from 0 to 2 pi inclusive
+    :param lat: Latitude of the beam axis
+    :param dmax: Largest spherical distance from the axis
+    :return: rows and column offsets (relative to the column of the axis) of the candidate points
+    """
+    nperiod = len(vphi) - 1
+    phistep = 2 * np.pi / nperiod
+
+    # Only rows within dmax in latitude can be reached
+    rows = np.nonzero(np.abs(vth - lat) <= dmax + 1e-12)[0]
+
+    # Half width in longitude of the cap on every row (whole rows where the cap covers the pole)
+    denom = np.cos(lat) * np.cos(vth[rows])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = (np.sin(dmax / 2) ** 2 - np.sin((vth[rows] - lat) / 2) ** 2) / denom
+    full = (denom <= 1e-12) | (s >= 1)
+    half = np.where(full, np.pi, 2 * np.arcsin(np.sqrt(np.clip(s, 0, 1))))
+    width = np.minimum(np.ceil(half / phistep).astype(int) + 1, nperiod // 2)
+
+    # Flattened (row, offset) pairs, one block of 2 width + 1 columns per row
+    count = 2 * width + 1
+    count[full | (count >= nperiod)] = nperiod
+    row_idx = np.repeat(rows, count)
+    first = np.repeat(np.where(count == nperiod, -(nperiod // 2), -width), count)
+    offsets = first + np.arange(len(row_idx)) - np.repeat(np.cumsum(count) - count, count)
+
+    return row_idx, offsets
+
+
+def beam_luminosity_sparse(nth, nphi, beams, floor, star_rot_angs, nsigma=6.0):
+    """
+    Generate the beam patterns like beam_luminosity_all, but evaluating every Gaussian only within nsigma
+    of its cone (|d - th| <= nsigma sigma); elsewhere it is truncated to zero. The floor is added afterwards
+    and its integral analytically.
+    :param nth: Number of theta divisions
+    :param nphi: Number of phi divisions
+    :param beams: BeamSet, or list of Beam objects or beam parameter dictionaries
+    :param floor: Minimum value of the beam pattern
+    :param star_rot_angs: Rotational angles of the star, shape (nang,)
+    :param nsigma: Half width of the evaluated support in units of sigma
+    :return: theta (vth), phi (vphi) coordinates and the normalized luminosity patterns (nlum), shape (nang, nth, nphi)
+    """
+    beams = BeamSet.from_beams(beams)
+    star_rot_angs = np.atleast_1d(np.asarray(star_rot_angs, dtype=float))
+    vth, vphi, sang = sky_grid(nth, nphi)
+    nang = len(star_rot_angs)
+    nperiod = nphi - 1
+    phistep = 2 * np.pi / nperiod
+
+    # Accumulate the beams on the distinct columns; the column at 2 pi repeats the one at 0
+    pattern = np.zeros(nang * nth * nperiod)
+    long = (beams.long[None, :] + star_rot_angs[:, None]) % (2 * np.pi)
+    for b in range(len(beams)):
+        rows, offsets = beam_support(vth, vphi, beams.lat[b], min(beams.th[b] + nsigma * beams.sigma[b], np.pi))
+        cols = (np.round(long[:, b] / phistep).astype(int)[:, None] + offsets[None, :]) % nperiod
+
+        a = (np.sin((vth[rows] - beams.lat[b]) / 2) ** 2
+             + np.cos(beams.lat[b]) * np.cos(vth[rows]) * np.sin((vphi[cols] - long[:, b, None]) / 2) ** 2)
+        sph_dist = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+        dist = sph_dist - beams.th[b]
+        values = np.where(np.abs(dist) <= nsigma * beams.sigma[b],
+                          beams.norm[b] * np.exp(-(dist ** 2) / (2 * beams.sigma[b] ** 2)), 0.0)
+
+        index = (np.arange(nang)[:, None] * nth + rows[None, :]) * nperiod + cols
+        pattern += np.bincount(index.ravel(), weights=values.ravel(), minlength=len(pattern))
+
+    pattern = pattern.reshape(nang, nth, nperiod)
+    beam_pattern = np.concatenate([pattern, pattern[:, :, :1]], axis=2)
+
+    # Integral of the beams plus the floor over the whole grid
+    beamint = np.sum(beam_pattern * sang[:, None], axis=(1, 2)) + floor * nphi * np.sum(sang)
+    beam_pattern += floor
+
+    return vth, vphi, beam_pattern / beamint[:, None, None]
+
+
+def beam_integrals(beams, nquad=None):
+    """
+    Integral over the sphere of every Gaussian beam, 2 pi int norm exp(-(d - th)^2 / (2 sigma^2)) sin d dd,
+    by Gauss-Legendre quadrature in the distance d from the beam axis.
+    :param beams: BeamSet, or list of Beam objects or beam parameter dictionaries
+    :param nquad: Number of quadrature nodes (enough for the narrowest beam by default)
+    :return: Integrals, (nbeam,)
+    """
+    beams = BeamSet.from_beams(beams)
+    if nquad is None:
+        nquad = int(np.ceil(10 * np.pi / np.min(beams.sigma))) + 64
+    x, w = np.polynomial.legendre.leggauss(nquad)
+    d = np.pi * (x + 1) / 2
+    w = np.pi * w / 2
+
+    profiles = np.exp(-((d[None, :] - beams.th[:, None]) ** 2) / (2 * beams.sigma[:, None] ** 2))
+    return 2 * np.pi * beams.norm * np.sum(profiles * (w * np.sin(d))[None, :], axis=1)
+
+
+def beam_pattern_at(lat, lon, beams, floor, star_rot_angs):
+    """
+    Beam pattern (not normalized) evaluated directly at arbitrary directions, without a sky grid.
+    :param lat: Latitudes (the theta of beam_luminosity)
+    :param lon: Longitudes (the phi of beam_luminosity), broadcastable against lat
+    :param beams: BeamSet, or list of Beam objects or beam parameter dictionaries
+    :param floor: Minimum value of the beam pattern
+    :param star_rot_angs: Rotational angles of the star, shape (nang,)
+    :return: Pattern at the directions, shape (nang, *shape of lat and lon)
+    """
+    beams = BeamSet.from_beams(beams)
+    star_rot_angs = np.atleast_1d(np.asarray(star_rot_angs, dtype=float))
+    lat, lon = np.broadcast_arrays(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float))
+    shape = lat.shape
+    lat, lon = lat.ravel(), lon.ravel()
+
+    # Spherical distances as in sphdist, shape (nang, nbeam, ndir)
+    long = (beams.long[None, :] + star_rot_angs[:, None]) % (2 * np.pi)
+    blat = beams.lat[:, None]
+    a_lat = np.sin((lat[None, :] - blat) / 2) ** 2
+    coslat = np.cos(blat) * np.cos(lat[None, :])
+    a = a_lat + coslat * np.sin((lon - long[..., None]) / 2) ** 2
+    sph_dist = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    th = beams.th[None, :, None]
+    sigma = beams.sigma[None, :, None]
+    beam_pattern = np.sum(beams.norm[None, :, None] * np.exp(-((sph_dist - th) ** 2) / (2 * sigma ** 2)), axis=1)
+    beam_pattern += floor
+
+    return beam_pattern.reshape((len(star_rot_angs),) + shape)
+
+
+def beam_luminosity_at(lat, lon, beams, floor, star_rot_angs):
+    """
+    Normalized beam pattern evaluated directly at arbitrary directions, without a sky grid.
+    The pattern is normalized by its integral over the sphere (beam_integrals plus 4 pi floor).
+    :param lat: Latitudes (the theta of beam_luminosity)
+    :param lon: Longitudes (the phi of beam_luminosity), broadcastable against lat
+    :param beams: BeamSet, or list of Beam objects or beam parameter dictionaries
+    :param floor: Minimum value of the beam pattern
+    :param star_rot_angs: Rotational angles of the star, shape (nang,)
+    :return: Normalized luminosity at the directions, shape (nang, *shape of lat and lon)
+    """
+    beams = BeamSet.from_beams(beams)
+    beamint = np.sum(beam_integrals(beams)) + 4 * np.pi * floor
+    return beam_pattern_at(lat, lon, beams, floor, star_rot_angs) / beamint
+
+
+def beam_luminosity_threaded(nth, nphi, beams, floor, star_rot_angs, workers=None, executor=None):
+    """
+    beam_luminosity_all with the rotations split into blocks evaluated by a pool of threads. NumPy releases
+    the GIL in the heavy array operations, and the threads share the (immutable) beams and write into one
+    output array, so nothing is copied between workers.
+    :param nth: Number of theta divisions
+    :param nphi: Number of phi divisions
+    :param beams: BeamSet, or list of Beam objects or beam parameter dictionaries
+    :param floor: Minimum value of the beam pattern
+    :param star_rot_angs: Rotational angles of the star, shape (nang,)
+    :param workers: Number of blocks (and threads of the pool created when no executor is given);
+                    the number of CPUs by default
+    :param executor: Optional concurrent.futures executor to run the blocks on
+    :return: theta (vth), phi (vphi) coordinates and the normalized luminosity patterns (nlum), shape (nang, nth, nphi)
+    """
+    beams = BeamSet.from_beams(beams)
+    star_rot_angs = np.atleast_1d(np.asarray(star_rot_angs, dtype=float))
+    workers = workers or os.cpu_count() or 1
+    vth, vphi, _ = sky_grid(nth, nphi)
+
+    nlum = np.empty((len(star_rot_angs), nth, nphi))
+    blocks = [block for block in np.array_split(np.arange(len(star_rot_angs)), workers) if len(block)]
+
+    def evaluate(block):
+        nlum[block[0]:block[-1] + 1] = beam_luminosity_all(nth, nphi, beams, floor, star_rot_angs[block])[2]
+
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(evaluate, blocks))
+    else:
+        list(executor.map(evaluate, blocks))
+
+    return vth, vphi, nlum
+
+
+def star_profile(beams, floor, obselev, phases, obslong=0.0, lum38=1.0):
+    """
+    Flux of the star seen by a distant observer, 4 pi lum38 times the normalized pattern toward the
+    observer (as instar in diskspecrest), evaluated directly for any spin phases and elevations.
+    :param beams: BeamSet, list of Beam objects or beam parameter dictionaries, or any beam source with a
+                  luminosity_at(lat, lon, star_rot_angs) method such as a BeamMap
+    :param floor: Minimum value of the beam pattern (not used by other sources)
+    :param obselev: Observer elevation angle(s)
+    :param phases: Spin phases of the star in turns; the star is rotated by 2 pi phase
+    :param obslong: Longitude of the observer
+    :param lum38: Luminosity of the star in 10^38 erg/s
+    :return: Profile, shape (nphase, *shape of obselev)
+    """
+    star_rot_angs = 2 * np.pi * np.atleast_1d(np.asarray(phases, dtype=float))
+    if hasattr(beams, 'luminosity_at'):
+        nlum = beams.luminosity_at(obselev, obslong, star_rot_angs)
+    else:
+        nlum = beam_luminosity_at(obselev, obslong, beams, floor, star_rot_angs)
+    return 4.0 * np.pi * lum38 * nlum
+
+
+def beam_set_from_params(params):
+    """Beams described by the beam_<n>_<parameter> keys of a par.npz file."""
+    beams = {}
+    for key in params:
+        if key.startswith('beam_'):
+            _, idx, param_type = key.split('_')
+            beams.setdefault(int(idx), {})[param_type] = params[key]
+    return BeamSet.from_beams([beams[idx] for idx in sorted(beams)])
+
+
+def beam_floor(params):
+    """Floor added to the Gaussian beams of a par.npz file (0.1 when the file does not set it)."""
+    return float(params['floor']) if 'floor' in params else 0.1
+
+
+class BeamBasis:
+    """
+    Least-recently-used cache of unit beam patterns (norm 1, no floor) and their integrals, keyed by
+    (long, lat, sigma, th, nth, nphi). The pattern is linear in the norms and in the floor, so patterns
+    for any norms and floor follow from a weighted sum of the cached ones.
+    """
+    def __init__(self, maxbytes=512 * 2**20):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        # The cache may be shared by threads; the patterns themselves are computed outside the lock
+        self.lock = threading.Lock()
+
+    def units(self, nth, nphi, long, lat, sigma, th):
+        """
+        Unit patterns of a list of beams, computing only the ones that are not cached yet.
+        :param nth: Number of theta divisions
+        :param nphi: Number of phi divisions
+        :param long, lat, sigma, th: Beam parameters, (n,)
+        :return: patterns, shape (n, nth, nphi), and their integrals, shape (n,)
+        """
+        keys = [(float(lo), float(la), float(si), float(t), int(nth), int(nphi)) for lo, la, si, t in zip(long, lat, sigma, th)]
+
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            vth, vphi, sang = sky_grid(nth, nphi)
+            lo, la, si, t = np.array([key[:4] for key in missing]).T
+            profiles = gaussian_patterns(vth, vphi, lo[None, :], la, si, t)[0]
+            profiles.setflags(write=False)
+            integrals = np.sum(profiles * sang[:, None], axis=(1, 2))
+            with self.lock:
+                for key, profile, integral in zip(missing, profiles, integrals):
+                    found[key] = (profile, integral)
+                    if key not in self.entries:
+                        self.entries[key] = (profile, integral)
+                        self.nbytes += profile.nbytes
+                # Drop the least recently used patterns once over the memory limit
+                while self.nbytes > self.maxbytes and self.entries:
+                    _, (profile, _) = self.entries.popitem(last=False)
+                    self.nbytes -= profile.nbytes
+
+        return np.array([found[key][0] for key in keys]), np.array([found[key][1] for key in keys])
+
+    def luminosity(self, nth, nphi, beams, floor, star_rot_angs):
+        """
+        Same as beam_luminosity_all, built from the cached unit patterns.
+        :return: vth, vphi and the normalized luminosity patterns, shape (nang, nth, nphi)
+        """
+        beams = BeamSet.from_beams(beams)
+        star_rot_angs = np.atleast_1d(np.asarray(star_rot_angs, dtype=float))
+        vth, vphi, sang = sky_grid(nth, nphi)
+
+        long = (beams.long[None, :] + star_rot_angs[:, None]) % (2 * np.pi)
+        shape = long.shape
+        tile = lambda v: np.broadcast_to(v, shape).ravel()
+        profiles, integrals = self.units(nth, nphi, long.ravel(), tile(beams.lat), tile(beams.sigma), tile(beams.th))
+        profiles = profiles.reshape(shape + (nth, nphi))
+        integrals = integrals.reshape(shape)
+
+        # Weighted sum of the unit patterns, with the integral of the floor added analytically
+        beam_pattern = np.sum(beams.norm[None, :, None, None] * profiles, axis=1)
+        beam_pattern += floor
+        beamint = np.sum(beams.norm[None, :] * integrals, axis=1) + floor * nphi * np.sum(sang)
+
+        return vth, vphi, beam_pattern / beamint[:, None, None]
+
+
+# Cache shared by all the runs of a session
+beam_basis = BeamBasis()
+
+
+def rotate_patterns(vth, vphi, nlum, star_rot_angs):
+    """
+    Rotate a beam pattern about the spin axis by shifting it along vphi instead of re-evaluating the beams.
+    vphi from beam_luminosity runs from 0 to 2 pi inclusive, so the pattern has nphi - 1 distinct columns.
+    Angles that are whole multiples of the column spacing are applied by an exact roll, any other angle by
+    a Fourier (band-limited) fractional shift.
+    :param vth: theta coordinates of the pattern
+    :param vphi: phi coordinates of the pattern
+    :param nlum: Normalized luminosity pattern (nth, nphi) of the unrotated star
+    :param star_rot_angs: Rotational angles of the star, shape (nang,)
+    :return: Normalized luminosity patterns for every angle, shape (nang, nth, nphi)
+    """
+    star_rot_angs = np.atleast_1d(np.asarray(star_rot_angs, dtype=float))
+    nperiod = len(vphi) - 1
+    base = nlum[:, :nperiod]
+    _, _, sang = sky_grid(len(vth), len(vphi))
+
+    # Shift of every rotation in columns
+    shift = star_rot_angs * nperiod / (2 * np.pi)
+    whole = np.isclose(shift, np.round(shift), rtol=0, atol=1e-9)
+
+    rotated = np.empty((len(star_rot_angs),) + base.shape)
+    if np.any(whole):
+        # Exact roll: column j of the rotated pattern is column j - shift of the base pattern
+        icol = (np.arange(nperiod)[None, :] - np.round(shift[whole]).astype(int)[:, None]) % nperiod
+        rotated[whole] = np.moveaxis(base[:, icol], 1, 0)
+    if not np.all(whole):
+        freq = np.fft.rfftfreq(nperiod, 1 / nperiod)
+        phase = np.exp(-2j * np.pi * freq[None, :] * shift[~whole, None] / nperiod)
+        if nperiod % 2 == 0:
+            # The Nyquist term of a real signal can only be shifted by its real part
+            phase[:, -1] = phase[:, -1].real
+        spec = np.fft.rfft(base, axis=-1)
+        rotated[~whole] = np.fft.irfft(spec[None, :, :] * phase[:, None, :], n=nperiod, axis=-1)
+
+    # Close the grid at 2 pi again and renormalize, since the repeated column is part of the integral
+    rotated = np.concatenate([rotated, rotated[:, :, :1]], axis=-1)
+    beamint = np.sum(rotated * sang[:, None], axis=(1, 2))
+
+    return rotated / beamint[:, None, None]
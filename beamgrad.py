@@ -0,0 +1,194 @@
+"""
+Derivatives of the illumination, the absorbed luminosity and the pulse profiles with respect to the
+beam parameters, in closed form.
+
+Every derivative is taken with respect to the parameters of every beam, in the order of BEAM_PARAMS
+(angles in radians). The nearest-point lookups (or interpolation weights) of the disk and of the
+observer on the beam grid, the lit side of the disk and its visibility do not depend on the beams, so
+the chain is exact for the discretized model: Gaussian profiles -> normalized pattern -> labs ->
+T ~ labs^(1/4), and inrep = fsee sum(labs) over the visible points.
+"""
+import os
+import numpy as np
+from beam import BeamSet, beam_floor, beam_set_from_params, sky_grid
+from diskgeometry import disk_geometry_from_params, interpolate_grid
+from disktemp import disktemp_geometry
+
+# Parameters of a beam, in the order of the Jacobian axes
+BEAM_PARAMS = ('long', 'lat', 'sigma', 'th', 'norm')
+
+
+def pattern_jacobian(nth, nphi, beams, floor, star_rot_angs):
+    """
+    Normalized beam patterns, as beam_luminosity_all, and their derivatives.
+    :param nth: Number of theta divisions
+    :param nphi: Number of phi divisions
+    :param beams: BeamSet, or list of Beam objects or beam parameter dictionaries
+    :param floor: Minimum value of the beam pattern
+    :param star_rot_angs: Rotational angles of the star, shape (nang,)
+    :return: vth, vphi, nlum (nang, nth, nphi) and dnlum (nang, nbeam, 5, nth, nphi)
+    """
+    beams = BeamSet.from_beams(beams)
+    star_rot_angs = np.atleast_1d(np.asarray(star_rot_angs, dtype=float))
+    vth, vphi, sang = sky_grid(nth, nphi)
+
+    long = ((beams.long[None, :] + star_rot_angs[:, None]) % (2 * np.pi))[:, :, None, None]
+    lat = beams.lat[None, :, None, None]
+    sigma = beams.sigma[None, :, None, None]
+    th = beams.th[None, :, None, None]
+    norm = beams.norm[None, :, None, None]
+    theta = vth[None, None, :, None]
+    dlon = vphi[None, None, None, :] - long
+    dlat = theta - lat
+
+    # Spherical distance (as in sphdist) and its derivatives with respect to the beam axis
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(theta) * np.sin(dlon / 2) ** 2
+    sph_dist = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    da_dlong = -0.5 * np.cos(lat) * np.cos(theta) * np.sin(dlon)
+    da_dlat = -0.5 * np.sin(dlat) - np.sin(lat) * np.cos(theta) * np.sin(dlon / 2) ** 2
+    # The distance is not differentiable on the axis itself (and at the opposite pole)
+    aa = a * (1 - a)
+    dd_da = np.where(aa > 1e-300, 1 / np.sqrt(np.where(aa > 1e-300, aa, 1.0)), 0.0)
+
+    g = np.exp(-((sph_dist - th) ** 2) / (2 * sigma ** 2))
+    q = (sph_dist - th) / sigma ** 2
+    dP = np.stack([
+        -norm * g * q * dd_da * da_dlong,
+        -norm * g * q * dd_da * da_dlat,
+        norm * g * (sph_dist - th) ** 2 / sigma ** 3,
+        norm * g * q,
+        g * np.ones_like(norm),
+    ], axis=2)
+
+    beam_pattern = np.sum(norm * g, axis=1) + floor
+
+    # Normalization by the grid integral, and the derivative of that integral
+    beamint = np.sum(beam_pattern * sang[:, None], axis=(1, 2))
+    dbeamint = np.sum(dP * sang[:, None], axis=(3, 4))
+    nlum = beam_pattern / beamint[:, None, None]
+    dnlum = (dP / beamint[:, None, None, None, None]
+             - nlum[:, None, None] * (dbeamint / beamint[:, None, None])[..., None, None])
+
+    return vth, vphi, nlum, dnlum
+
+
+def labs_jacobian(geometry, rinphys, thbeam, phbeam, illum, dillum, interpolation='nearest'):
+    """
+    Absorbed luminosity and temperature of the disk, as disktemp_geometry, and their derivatives.
+    :param geometry: DiskGeometry of the disk
+    :param rinphys: Inner physical radius
+    :param thbeam: Array of theta illumination of the beams
+    :param phbeam: Array of phi illumination of the beams
+    :param illum: Illumination array, (nth, nphi)
+    :param dillum: Derivatives of the illumination, (..., nth, nphi)
+    :param interpolation: 'nearest' beam grid point, or 'bilinear' / 'bicubic' interpolation of the
+                          illumination (linear in it, so the derivatives are interpolated the same way)
+    :return: side, T, labs, lemit and the derivatives dT, dlabs (..., npoints, nprof), dlemit (...)
+    """
+    side, T, sang, labs, lemit = disktemp_geometry(geometry, rinphys, thbeam, phbeam, illum, interpolation)
+    lit = side != 0
+
+    if interpolation == 'nearest':
+        disk_illum_th, disk_illum_phi = geometry.illum_index(thbeam, phbeam)
+        dillum_on_disk = dillum[..., disk_illum_th, disk_illum_phi]
+    else:
+        stencil = geometry.illum_stencil(thbeam, phbeam, interpolation)
+        dillum_on_disk = interpolate_grid(dillum, *stencil)
+        if interpolation == 'bicubic':
+            # The illumination is clamped at zero where the interpolation overshoots, and so is its derivative
+            dillum_on_disk = np.where(interpolate_grid(illum, *stencil) > 0, dillum_on_disk, 0.0)
+    dlabs = np.where(lit, dillum_on_disk * sang, 0.0)
+
+    # T is proportional to labs^(1/4) on the lit points
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dT = np.where(labs > 0, T / (4 * labs) * dlabs, 0.0)
+    dlemit = np.sum(dlabs, axis=(-2, -1))
+
+    return side, T, labs, lemit, dT, dlabs, dlemit
+
+
+def beam_jacobians(bdir):
+    """
+    Jacobians of the whole disktempsave -> diskspecrest chain with respect to the beam parameters, for
+    Gaussian beams evaluated on the beam grid and the grid illumination (other settings raise a
+    ValueError). The profiles use the same viewing angles and observer as diskspecrest.
+    The profile derivatives are saved in jacobian.npz.
+    :param bdir: Directory with par.npz
+    :return: Dictionary with illum, dillum (nang, [nbeam, 5,] nth, nphi), labs, dlabs and T, dT
+             (nang, [nbeam, 5,] npoints, nprof), lemitv, dlemitv, and the profiles instar, inrep with
+             dinstar, dinrep (nangtoview, nang, [nbeam, 5])
+    """
+    params = np.load(os.path.join(bdir, 'par.npz'))
+    nang = int(params['nang'])
+    nth = int(params['nth'])
+    nphi = int(params['nphi'])
+    rinphys = params['rinphys']
+    lum38 = params['lum38']
+    interpolation = str(params['interpolation']) if 'interpolation' in params else 'nearest'
+    floor = beam_floor(params)
+
+    # Only the Gaussian beams evaluated on the beam grid, with the illumination taken from the grid,
+    # are differentiated
+    unsupported = [f"{key}={value!r}" for key, value, default in (
+        ('beammap', str(params['beammap']) if 'beammap' in params else '', ''),
+        ('sky', str(params['sky']) if 'sky' in params else 'grid', 'grid'),
+        ('illumination', str(params['illumination']) if 'illumination' in params else 'grid', 'grid'),
+        ('pattern', str(params['pattern']) if 'pattern' in params else 'grid', 'grid'),
+        ('rotation', str(params['rotation']) if 'rotation' in params else 'evaluate', 'evaluate'),
+        ('nsigma', float(params['nsigma']) if 'nsigma' in params else 0.0, 0.0)) if value != default]
+    if unsupported:
+        raise ValueError(f"The beam Jacobians cannot be taken with {', '.join(unsupported)}")
+
+    beams = beam_set_from_params(params)
+    geometry = disk_geometry_from_params(params)
+    ph = geometry.ph
+
+    rotation_angles = np.arange(nang) * 2 * np.pi / nang
+    shape = (nang, len(beams), len(BEAM_PARAMS))
+    illum = np.zeros((nang, nth, nphi))
+    dillum = np.zeros(shape + (nth, nphi))
+    labs = np.zeros((nang,) + geometry.ang.shape)
+    T = np.zeros_like(labs)
+    dlabs = np.zeros(shape + geometry.ang.shape)
+    dT = np.zeros_like(dlabs)
+    lemitv = np.zeros(nang)
+    dlemitv = np.zeros(shape)
+    side = None
+    for k in range(nang):
+        # Beam pattern of this rotation, with the floor used by disktempsave
+        thbeam, phbeam, nlum, dnlum = pattern_jacobian(nth, nphi, beams, floor, rotation_angles[k:k + 1])
+        illum[k] = nlum[0] * lum38
+        dillum[k] = dnlum[0] * lum38
+
+        side, T[k], labs[k], lemitv[k], dT[k], dlabs[k], dlemitv[k] = labs_jacobian(
+            geometry, rinphys, thbeam, phbeam, illum[k], dillum[k], interpolation)
+
+    # Viewing angles and observer as in diskspecrest
+    nangtoview = 2
+    angc = 0.67 - np.arange(nangtoview) / nangtoview
+    obselev = 0.0
+    ithobs = np.argmin(np.abs(thbeam - obselev))
+
+    instar = np.zeros((nangtoview, nang))
+    inrep = np.zeros((nangtoview, nang))
+    dinstar = np.zeros((nangtoview,) + shape)
+    dinrep = np.zeros((nangtoview,) + shape)
+    for i in range(nangtoview):
+        if angc[i] >= 0.0:
+            irot = np.argmin(np.abs(phbeam - 2.0 * np.pi * angc[i]))
+        else:
+            irot = np.argmin(np.abs(phbeam - (2.0 * np.pi + 2.0 * np.pi * angc[i])))
+        instar[i] = 4.0 * np.pi * illum[:, ithobs, irot]
+        dinstar[i] = 4.0 * np.pi * dillum[..., ithobs, irot]
+
+        # Visible points and the (last point's) fraction of the area facing the observer, as in dtmpspec
+        top, fsee, iplot = geometry.visibility(ph, angc[i], obselev)
+        visible = iplot + top * side == 2
+        inrep[i] = fsee[-1, -1] * np.sum(labs[:, visible], axis=-1)
+        dinrep[i] = fsee[-1, -1] * np.sum(dlabs[..., visible], axis=-1)
+
+    np.savez(os.path.join(bdir, 'jacobian.npz'), params=np.array(BEAM_PARAMS), instar=instar, inrep=inrep,
+             dinstar=dinstar, dinrep=dinrep, lemitv=lemitv, dlemitv=dlemitv)
+
+    return dict(illum=illum, dillum=dillum, labs=labs, dlabs=dlabs, T=T, dT=dT, lemitv=lemitv, dlemitv=dlemitv,
+                instar=instar, inrep=inrep, dinstar=dinstar, dinrep=dinrep)
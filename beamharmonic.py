@@ -0,0 +1,150 @@
+"""
+Band-limited spherical-harmonic representation of beam patterns.
+
+Every beam of beam.py is symmetric about its own axis, so its expansion follows from a one-dimensional
+Legendre transform of its profile (Funk-Hecke): a_lm = f_l conj(Y_lm(axis)). Rotating the star about
+the spin axis multiplies a_lm by exp(-i m angle), and the integral over the sphere is sqrt(4 pi) a_00.
+Directions are (latitude, longitude) as in beam_luminosity.
+"""
+import numpy as np
+from beam import BeamSet
+
+
+def normalized_legendre(lmax, x):
+    """
+    Orthonormal associated Legendre functions, so that P_lm(cos colatitude) exp(i m phi) are the
+    spherical harmonics Y_lm (with the Condon-Shortley phase).
+    :param lmax: Band limit
+    :param x: Cosines of the colatitudes (sines of the latitudes)
+    :return: P, shape (lmax + 1, lmax + 1, *x.shape), zero for m > l
+    """
+    x = np.asarray(x, dtype=float)
+    s = np.sqrt(np.maximum(1 - x**2, 0))
+
+    P = np.zeros((lmax + 1, lmax + 1) + x.shape)
+    pmm = np.full(x.shape, 1 / np.sqrt(4 * np.pi))
+    for m in range(lmax + 1):
+        if m > 0:
+            pmm = -np.sqrt((2 * m + 1) / (2 * m)) * s * pmm
+        P[m, m] = pmm
+        if m < lmax:
+            P[m + 1, m] = np.sqrt(2 * m + 3) * x * pmm
+        for l in range(m + 2, lmax + 1):
+            a = np.sqrt((4 * l**2 - 1) / (l**2 - m**2))
+            b = np.sqrt((4 * (l - 1)**2 - 1) / ((l - 1)**2 - m**2))
+            P[l, m] = a * (x * P[l - 1, m] - P[l - 2, m] / b)
+    return P
+
+
+def legendre(lmax, x):
+    """Legendre polynomials P_l(x) for l = 0 ... lmax, shape (lmax + 1, *x.shape)."""
+    x = np.asarray(x, dtype=float)
+    P = np.zeros((lmax + 1,) + x.shape)
+    P[0] = 1
+    if lmax > 0:
+        P[1] = x
+    for l in range(2, lmax + 1):
+        P[l] = ((2 * l - 1) * x * P[l - 1] - (l - 1) * P[l - 2]) / l
+    return P
+
+
+def profile_transform(lmax, sigma, th, norm, nquad=None):
+    """
+    Legendre transform f_l = 2 pi int f(d) P_l(cos d) sin d dd of the beam profiles
+    f(d) = norm exp(-(d - th)^2 / (2 sigma^2)).
+    :param lmax: Band limit
+    :param sigma, th, norm: Beam parameters, shape (nbeam,)
+    :param nquad: Number of Gauss-Legendre nodes in d (enough for the narrowest beam by default)
+    :return: f_l, shape (nbeam, lmax + 1)
+    """
+    if nquad is None:
+        nquad = max(4 * (lmax + 1), int(np.ceil(10 * np.pi / np.min(sigma)))) + 64
+    x, w = np.polynomial.legendre.leggauss(nquad)
+    d = np.pi * (x + 1) / 2
+    w = np.pi * w / 2
+
+    f = norm[:, None] * np.exp(-((d[None, :] - th[:, None]) ** 2) / (2 * sigma[:, None] ** 2))
+    return 2 * np.pi * np.einsum('bk,lk->bl', f * (w * np.sin(d))[None, :], legendre(lmax, np.cos(d)))
+
+
+class BeamHarmonics:
+    """
+    Spherical-harmonic coefficients a_lm (m >= 0) of a real beam pattern.
+    The expansion converges spectrally for smooth patterns; a beam whose profile has a slope at its
+    axis (th > 0) or at the opposite pole (very broad beams) has a cusp there and converges more slowly.
+    """
+    def __init__(self, coeffs):
+        self.coeffs = np.asarray(coeffs, dtype=complex)
+        self.lmax = self.coeffs.shape[0] - 1
+
+    @classmethod
+    def from_beams(cls, beams, floor=0.0, lmax=None):
+        """
+        Expand the sum of the Gaussian beams plus a constant floor, as in beam_luminosity.
+        :param beams: BeamSet, or list of Beam objects or beam parameter dictionaries
+        :param floor: Minimum value of the beam pattern
+        :param lmax: Band limit; by default high enough to resolve the narrowest beam to ~1e-8
+        """
+        beams = BeamSet.from_beams(beams)
+        if lmax is None:
+            lmax = int(np.ceil(6 / np.min(beams.sigma)))
+
+        fl = profile_transform(lmax, beams.sigma, beams.th, beams.norm)
+        m = np.arange(lmax + 1)
+        Ylm_axis = normalized_legendre(lmax, np.sin(beams.lat)) * np.exp(1j * m[None, :, None] * beams.long[None, None, :])
+        coeffs = np.einsum('bl,lmb->lm', fl, np.conj(Ylm_axis))
+        coeffs[0, 0] += floor * np.sqrt(4 * np.pi)
+
+        return cls(coeffs)
+
+    @property
+    def integral(self):
+        """Integral of the pattern over the sphere."""
+        return np.sqrt(4 * np.pi) * self.coeffs[0, 0].real
+
+    def rotate(self, star_rot_ang):
+        """Pattern of the star rotated by star_rot_ang about its spin axis (the beam longitudes increase)."""
+        m = np.arange(self.lmax + 1)
+        return BeamHarmonics(self.coeffs * np.exp(-1j * m * star_rot_ang)[None, :])
+
+    def evaluate(self, lat, lon, block=8192):
+        """
+        Pattern at arbitrary directions.
+        :param lat: Latitudes
+        :param lon: Longitudes (same shape as lat)
+        :param block: Number of directions evaluated at once
+        :return: Pattern values, shape of lat
+        """
+        lat, lon = np.broadcast_arrays(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float))
+        flat_lat, flat_lon = lat.ravel(), lon.ravel()
+        m = np.arange(self.lmax + 1)
+        # Terms with m > 0 stand for the m and -m pair
+        weight = np.where(m > 0, 2.0, 1.0)
+
+        out = np.empty(flat_lat.shape)
+        for start in range(0, len(flat_lat), block):
+            sl = slice(start, start + block)
+            bm = np.einsum('lm,lmk->mk', self.coeffs, normalized_legendre(self.lmax, np.sin(flat_lat[sl])))
+            out[sl] = np.einsum('m,mk->k', weight, (bm * np.exp(1j * m[:, None] * flat_lon[None, sl])).real)
+        return out.reshape(lat.shape)
+
+    def grid(self, vth, vphi, star_rot_angs=(0.0,)):
+        """
+        Pattern on a (vth, vphi) grid for several rotations of the star, by separating latitude and longitude.
+        :param vth: theta (latitude) coordinates, (nth,)
+        :param vphi: phi coordinates, (nphi,)
+        :param star_rot_angs: Rotational angles of the star, (nang,)
+        :return: Pattern, shape (nang, nth, nphi)
+        """
+        star_rot_angs = np.atleast_1d(np.asarray(star_rot_angs, dtype=float))
+        m = np.arange(self.lmax + 1)
+        weight = np.where(m > 0, 2.0, 1.0)
+
+        bm = np.einsum('lm,lmi->im', self.coeffs, normalized_legendre(self.lmax, np.sin(vth)))
+        rot = np.exp(-1j * m[None, :] * star_rot_angs[:, None])
+        return np.einsum('aim,mj->aij', (bm[None, :, :] * rot[:, None, :]) * weight,
+                         np.exp(1j * m[:, None] * np.asarray(vphi)[None, :])).real
+
+    def luminosity(self, vth, vphi, star_rot_angs=(0.0,)):
+        """Patterns from grid normalized by their exact integral over the sphere, shape (nang, nth, nphi)."""
+        return self.grid(vth, vphi, star_rot_angs) / self.integral
@@ -0,0 +1,100 @@
+"""
+Tabulated beam patterns, e.g. sky maps from radiative-transfer codes, as an alternative to the Gaussian beams.
+
+A map is a .npy array of shape (nlat, nlon) sampled at latitudes from -pi/2 to pi/2 and longitudes from
+0 to 2 pi (periodic, the first longitude is not repeated at the end). The file is memory-mapped, so
+only the parts of the map that are interpolated or integrated are read, and a BeamMap is pickled by
+its path so that worker processes map the same file instead of receiving a copy.
+Directions are (latitude, longitude) as in beam_luminosity.
+"""
+import numpy as np
+from beam import sky_grid
+
+
+class BeamMap:
+    """Beam pattern interpolated bilinearly from a memory-mapped sky map."""
+
+    def __init__(self, path, lat=None, lon=None, block=1024):
+        """
+        :param path: .npy file with the map, (nlat, nlon)
+        :param lat: Latitudes of the rows (equally spaced from -pi/2 to pi/2 if None)
+        :param lon: Longitudes of the columns (k 2 pi / nlon if None)
+        :param block: Number of rows read at once when integrating the map
+        """
+        self.path = path
+        self.block = block
+        self.values = np.load(path, mmap_mode='r')
+        nlat, nlon = self.values.shape
+        self.lat = np.linspace(-np.pi / 2, np.pi / 2, nlat) if lat is None else np.asarray(lat, dtype=float)
+        self.lon = 2 * np.pi * np.arange(nlon) / nlon if lon is None else np.asarray(lon, dtype=float)
+        self._integral = None
+
+    def __getstate__(self):
+        return {'path': self.path, 'lat': self.lat, 'lon': self.lon, 'block': self.block}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['lat'], state['lon'], state['block'])
+
+    @property
+    def integral(self):
+        """Integral of the map over the sphere (trapezoid rule in latitude, periodic in longitude)."""
+        if self._integral is None:
+            wlat = np.zeros(len(self.lat))
+            wlat[1:] += np.diff(self.lat) / 2
+            wlat[:-1] += np.diff(self.lat) / 2
+            wlat *= np.cos(self.lat)
+            lon_ext = np.concatenate([self.lon[-1:] - 2 * np.pi, self.lon, self.lon[:1] + 2 * np.pi])
+            wlon = (lon_ext[2:] - lon_ext[:-2]) / 2
+
+            total = 0.0
+            for start in range(0, len(self.lat), self.block):
+                rows = slice(start, start + self.block)
+                total += wlat[rows] @ (np.asarray(self.values[rows]) @ wlon)
+            self._integral = total
+        return self._integral
+
+    def pattern_at(self, lat, lon, star_rot_angs=(0.0,)):
+        """
+        Map interpolated at arbitrary directions, for the star rotated by each angle about its spin axis
+        (the map turns with the star, so it is read at longitude - angle).
+        :param lat: Latitudes
+        :param lon: Longitudes, broadcastable against lat
+        :param star_rot_angs: Rotational angles of the star, shape (nang,)
+        :return: Pattern, shape (nang, *shape of lat and lon)
+        """
+        star_rot_angs = np.atleast_1d(np.asarray(star_rot_angs, dtype=float))
+        lat, lon = np.broadcast_arrays(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float))
+        nlat, nlon = self.values.shape
+
+        # Rows bracketing the latitudes (clamped at the poles)
+        i0 = np.clip(np.searchsorted(self.lat, lat, side='right') - 1, 0, nlat - 2)
+        wi = np.clip((lat - self.lat[i0]) / (self.lat[i0 + 1] - self.lat[i0]), 0, 1)
+
+        # Columns bracketing the rotated longitudes, periodic in longitude
+        lon_rot = np.mod(lon[None] - star_rot_angs.reshape((-1,) + (1,) * lat.ndim) - self.lon[0], 2 * np.pi) + self.lon[0]
+        j0 = np.searchsorted(self.lon, lon_rot, side='right') - 1
+        j1 = (j0 + 1) % nlon
+        lon1 = np.where(j1 == 0, self.lon[0] + 2 * np.pi, self.lon[j1])
+        wj = (lon_rot - self.lon[j0]) / (lon1 - self.lon[j0])
+
+        # Only the four neighbours of every direction are read from the map
+        v = self.values
+        return ((1 - wi) * ((1 - wj) * v[i0, j0] + wj * v[i0, j1])
+                + wi * ((1 - wj) * v[i0 + 1, j0] + wj * v[i0 + 1, j1]))
+
+    def luminosity_at(self, lat, lon, star_rot_angs=(0.0,)):
+        """Pattern at arbitrary directions normalized by the integral of the map, shape (nang, ...)."""
+        return self.pattern_at(lat, lon, star_rot_angs) / self.integral
+
+    def luminosity(self, nth, nphi, star_rot_angs=(0.0,)):
+        """
+        Pattern on the grid of beam_luminosity, normalized in the same way.
+        :param nth: Number of theta divisions
+        :param nphi: Number of phi divisions
+        :param star_rot_angs: Rotational angles of the star, shape (nang,)
+        :return: theta (vth), phi (vphi) coordinates and the normalized luminosity patterns (nlum), shape (nang, nth, nphi)
+        """
+        vth, vphi, sang = sky_grid(nth, nphi)
+        beam_pattern = self.pattern_at(vth[:, None], vphi[None, :], star_rot_angs)
+        beamint = np.sum(beam_pattern * sang[:, None], axis=(1, 2))
+        return vth, vphi, beam_pattern / beamint[:, None, None]
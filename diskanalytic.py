@@ -0,0 +1,92 @@
+"""
+Closed-form geometry of the warped disk.
+
+The surface is r (cos(th) cos(ang), sin(th) cos(ang), sin(ang)) with th = 2 pi ph and
+ang = -tilt(r) sin(th + off(r)), so its tangents, normals, area and solid angle elements
+follow directly from tilt, off and their radial derivatives.
+"""
+import numpy as np
+from warpmodel import warp_profiles
+
+
+def surface_derivatives(ph, tilt, dtilt, off, doff):
+    """
+    Disk angle and its partial derivatives at every mesh point.
+
+    :param ph: Phases of the mesh, (npoints,)
+    :param tilt, dtilt, off, doff: Tilt, twist and their radial derivatives, (nbatch, nprof)
+    :return: ang, dang_dr, dang_dth, each of shape (nbatch, npoints, nprof)
+    """
+    phase = 2 * np.pi * np.asarray(ph)[None, :, None] + off[:, None, :]
+    s = np.sin(phase)
+    c = np.cos(phase)
+
+    ang = -tilt[:, None, :] * s
+    dang_dr = -dtilt[:, None, :] * s - tilt[:, None, :] * doff[:, None, :] * c
+    dang_dth = -tilt[:, None, :] * c
+
+    return ang, dang_dr, dang_dth
+
+
+def tangent_vectors(ph, rv, ang, dang_dr, dang_dth):
+    """
+    Tangents of the surface along the profile (d/dr) and around the ring (d/dth).
+
+    :param ph: Phases of the mesh, (npoints,)
+    :param rv: Radii, (nbatch, nprof)
+    :param ang, dang_dr, dang_dth: From surface_derivatives
+    :return: P_r, P_th, each of shape (3, nbatch, npoints, nprof)
+    """
+    th = 2 * np.pi * np.asarray(ph)[None, :, None]
+    r = rv[:, None, :]
+    cth, sth = np.cos(th), np.sin(th)
+    ca, sa = np.cos(ang), np.sin(ang)
+
+    P_r = np.array([
+        cth * ca - r * cth * sa * dang_dr,
+        sth * ca - r * sth * sa * dang_dr,
+        sa + r * ca * dang_dr
+    ])
+    P_th = np.array([
+        r * (-sth * ca - cth * sa * dang_dth),
+        r * (cth * ca - sth * sa * dang_dth),
+        r * ca * dang_dth
+    ])
+
+    return P_r, P_th
+
+
+def surface_normal(P_r, P_th):
+    """Normal P_r x P_th, same orientation as the profile x ring cross product in disktemp."""
+    return np.array([
+        P_r[1] * P_th[2] - P_r[2] * P_th[1],
+        P_r[2] * P_th[0] - P_r[0] * P_th[2],
+        P_r[0] * P_th[1] - P_r[1] * P_th[0]
+    ])
+
+
+def area_element(normal):
+    """Area per unit dr dth."""
+    return np.sqrt(normal[0]**2 + normal[1]**2 + normal[2]**2)
+
+
+def solid_angle_element(ang, dang_dr):
+    """Solid angle seen from the central source per unit dr dth."""
+    return np.cos(ang) * np.abs(dang_dr)
+
+
+def analytic_disk(disk_parameters_v, ph, rfrac, warp=None):
+    """
+    Exact geometry of a stack of warped disks on a (possibly non-uniform) mesh.
+
+    :param disk_parameters_v: [rin, rout, tiltin, tiltout, phsoff], or an (nbatch, 5) stack of them
+    :param ph: Phases of the mesh, (npoints,)
+    :param rfrac: Fractional radii of the profile points, (nprof,)
+    :param warp: Optional WarpModel; the linear warp of the disk parameters if None
+    :return: rv (nbatch, nprof), ang, normal (3, ...), area and solid angle elements per unit dr dth
+    """
+    rv, tilt, dtilt, off, doff = warp_profiles(disk_parameters_v, rfrac, warp)
+    ang, dang_dr, dang_dth = surface_derivatives(ph, tilt, dtilt, off, doff)
+    normal = surface_normal(*tangent_vectors(ph, rv, ang, dang_dr, dang_dth))
+
+    return rv, ang, normal, area_element(normal), solid_angle_element(ang, dang_dr)
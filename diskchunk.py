@@ -0,0 +1,341 @@
+"""
+Tiled execution of disktemp and dtmpspec for disk grids too large to hold as dense arrays.
+
+The disk is walked in blocks of rows (phase) and columns (profile). Each block is evaluated together
+with a one-point halo, so the neighbour differences come out exactly as on the full grid, and the
+running max/min that decides the illuminated side is carried from one column block to the next.
+Full-size results are written to memory-mapped .npy files.
+"""
+import os
+import tempfile
+import numpy as np
+from diskshape import disk_profiles, disk_surface
+from diskgeometry import observer_rotate, interpolation_stencil, interpolate_grid
+from diskanalytic import analytic_disk
+from maskit import maskit_sorted
+from bbfrac import bbnorm_v
+
+class ChunkedDisk:
+    """
+    Tiled view of the disk described by a DiskGeometry. Only the one-dimensional phase and profile
+    vectors are kept in memory; the geometry's own dense arrays are never built.
+
+    :param geometry: DiskGeometry of a single disk (mesh, warp and analytic settings are taken from it)
+    :param chunk: Number of rows and of columns in a block
+    """
+
+    def __init__(self, geometry, chunk=256):
+        if geometry.shadow != 'profile':
+            raise ValueError(f"The '{geometry.shadow}' shadow is not available in chunked mode")
+        self.geometry = geometry
+        self.chunk = int(chunk)
+        self.npoints = geometry.npoints
+        self.nprof = geometry.nprof
+        self.ph, rv, tilt, off = disk_profiles(geometry.npoints, geometry.nprof, geometry.disk_parameters,
+                                               geometry.mesh, geometry.warp)
+        self.rv, self.tilt, self.off = rv[0], tilt[0], off[0]
+        self.jlo, self.jhi, self.ilo, self.ihi = geometry.neighbours
+        self.phistep = np.broadcast_to(geometry.phistep, (self.npoints, 1))
+
+        self._visibility = {}
+
+    def blocks(self):
+        """Row and column ranges of every block, row blocks outermost and columns in increasing order."""
+        for i0 in range(0, self.npoints, self.chunk):
+            for j0 in range(0, self.nprof, self.chunk):
+                yield slice(i0, min(i0 + self.chunk, self.npoints)), slice(j0, min(j0 + self.chunk, self.nprof))
+
+    def halo(self, rows, cols):
+        """
+        Surface of a block together with its neighbours.
+
+        :return: ang, xv, yv, zv on the extended block, and local (ilo, i, ihi, jlo, j, jhi) indices of
+                 the block points and their neighbours inside it
+        """
+        i = np.arange(rows.start, rows.stop)
+        j = np.arange(cols.start, cols.stop)
+
+        # Extended rows wrap around in phase, extended columns are clamped at the disk edges
+        erows = np.arange(rows.start - 1, rows.stop + 1) % self.npoints
+        ecols = np.arange(max(cols.start - 1, 0), min(cols.stop + 1, self.nprof))
+
+        surf = [v[0] for v in disk_surface(self.ph[erows], self.rv[None, ecols], self.tilt[None, ecols],
+                                           self.off[None, ecols])]
+
+        li = i - rows.start + 1
+        local = (li - 1, li, li + 1, self.jlo[j] - ecols[0], j - ecols[0], self.jhi[j] - ecols[0])
+        return surf, local
+
+    def orient(self, rows, cols, surf, local):
+        """Cross product of the neighbour vectors (or the scaled analytic normal) on a block."""
+        ilo, i, ihi, jlo, j, jhi = local
+        if self.geometry.analytic:
+            rfrac = self.geometry.rfrac
+            normal = analytic_disk(self.geometry.disk_parameters, self.ph[rows], rfrac[cols], self.geometry.warp)[2][:, 0]
+            rspan, thspan = self.geometry.spans
+            return normal * rspan[0][:, cols] * thspan[rows]
+
+        _, xv, yv, zv = surf
+        v1 = [c[i][:, jhi] - c[i][:, jlo] for c in (xv, yv, zv)]
+        v2 = [c[ihi][:, j] - c[ilo][:, j] for c in (xv, yv, zv)]
+        return np.array([
+            v1[1] * v2[2] - v1[2] * v2[1],
+            v1[2] * v2[0] - v1[0] * v2[2],
+            v1[0] * v2[1] - v1[1] * v2[0]
+        ])
+
+
+def open_backing(workdir, name, shape, dtype=float):
+    """Create a zero-filled memory-mapped .npy file."""
+    return np.lib.format.open_memmap(os.path.join(workdir, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+
+
+def disktemp_chunked(chunked, rinphys, thbeam, phbeam, illum, workdir=None, interpolation='nearest'):
+    """
+    Calculate the temperature of the disk block by block. Same side, T, sang, labs and lemit as disktemp.
+
+    :param chunked: ChunkedDisk of the disk
+    :param rinphys: Inner physical radius
+    :param thbeam: Array of theta illumination of the beams
+    :param phbeam: Array of phi illumination of the beams
+    :param illum: Illumination array, (nth, nphi), or a function of (latitude, longitude) giving the
+                  illumination directly at the disk points
+    :param workdir: Directory for the memory-mapped side.npy, T.npy, sang.npy and labs.npy (a new
+                    temporary directory if None)
+    :param interpolation: 'nearest' beam grid point, or 'bilinear' / 'bicubic' interpolation of the illumination
+    :return: side, T, sang, labs (memory-mapped), lemit
+    """
+
+    # PHYSICAL CONSTANTS--------
+    SBsigma = 5.6705E-5  # Stefan-Boltzmann constant in erg/(cm^2 K^4 s)
+
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='disktemp_')
+    os.makedirs(workdir, exist_ok=True)
+
+    shape = (chunked.npoints, chunked.nprof)
+    side = open_backing(workdir, 'side', shape, dtype=int)
+    T = open_backing(workdir, 'T', shape)
+    sang = open_backing(workdir, 'sang', shape)
+    labs = open_backing(workdir, 'labs', shape)
+    lemit = 0.0
+
+    if not callable(illum):
+        phi_stencil = interpolation_stencil(2 * np.pi * chunked.ph[:, None], phbeam, interpolation,
+                                            periodic=interpolation != 'nearest')
+
+    for rows, cols in chunked.blocks():
+        surf, local = chunked.halo(rows, cols)
+        ilo, i, ihi, jlo, j, jhi = local
+        ang_ext = surf[0]
+        ang = ang_ext[i][:, j]
+
+        # Running max/min along the profile, carried over from the previous column blocks of these rows
+        if cols.start == 0:
+            anghi_prev = np.full(len(i), -np.inf)
+            anglo_prev = np.full(len(i), np.inf)
+        anghi = np.maximum(np.maximum.accumulate(ang, axis=1), anghi_prev[:, None])
+        anglo = np.minimum(np.minimum.accumulate(ang, axis=1), anglo_prev[:, None])
+        before_hi = np.concatenate([anghi_prev[:, None], anghi[:, :-1]], axis=1)
+        before_lo = np.concatenate([anglo_prev[:, None], anglo[:, :-1]], axis=1)
+        anghi_prev, anglo_prev = anghi[:, -1], anglo[:, -1]
+
+        side_b = np.zeros(ang.shape, dtype=int)
+        side_b[ang > before_hi] = 1
+        side_b[ang < before_lo] = -1
+        if cols.start == 0:
+            side_b[:, 0] = 0
+        lit = side_b != 0
+
+        # Solid angle from the central source
+        if chunked.geometry.analytic:
+            _, _, _, _, dO = analytic_disk(chunked.geometry.disk_parameters, chunked.ph[rows],
+                                           chunked.geometry.rfrac[cols], chunked.geometry.warp)
+            sang_b = chunked.geometry.analytic_sang(dO, rows, cols)[0]
+        else:
+            sang_b = np.abs((2 * np.pi * chunked.phistep[rows]) * (ang_ext[i][:, jhi] - ang_ext[i][:, jlo]) / 2 * np.cos(ang))
+
+        # Luminosity absorbed and temperature of the illuminated segments
+        if callable(illum):
+            beam_illum_on_disk = illum(ang, 2 * np.pi * chunked.ph[rows, None])
+        else:
+            th_stencil = interpolation_stencil(ang, thbeam, interpolation)
+            beam_illum_on_disk = interpolate_grid(illum, th_stencil, tuple(v[rows] for v in phi_stencil))
+            if interpolation == 'bicubic':
+                # Catmull-Rom overshoots below zero next to steep drops of the illumination
+                beam_illum_on_disk = np.maximum(beam_illum_on_disk, 0.0)
+        labs_b = np.where(lit, beam_illum_on_disk * sang_b, 0.0)
+
+        ox, oy, oz = chunked.orient(rows, cols, surf, local)
+        area = rinphys**2 * np.sqrt(ox**2 + oy**2 + oz**2)
+        T_b = np.zeros(ang.shape)
+        T_b[lit] = (1E38)**(1/4) * (labs_b[lit] / (SBsigma * area[lit]))**(1/4)
+
+        side[rows, cols] = side_b
+        T[rows, cols] = T_b
+        sang[rows, cols] = sang_b
+        labs[rows, cols] = labs_b
+        lemit += np.sum(labs_b)
+
+    for v in (side, T, sang, labs):
+        v.flush()
+
+    return side, T, sang, labs, lemit
+
+
+def visibility_chunked(chunked, ph, phio, obselev, workdir=None):
+    """
+    Block-by-block version of DiskGeometry.visibility, kept per view on the ChunkedDisk.
+
+    :param chunked: ChunkedDisk of the disk
+    :param ph: Phi angles the disk was saved with
+    :param phio: Phase rotation of the disk
+    :param obselev: Observer elevation angle
+    :param workdir: Directory for the memory-mapped top.npy, iplot.npy and observer-frame coordinates
+    :return: top, fsee of the last point (as kept by dtmpspec), iplot
+    """
+    key = (float(phio), float(obselev))
+    if key in chunked._visibility:
+        return chunked._visibility[key]
+
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='diskvf_')
+    os.makedirs(workdir, exist_ok=True)
+
+    shape = (chunked.npoints, chunked.nprof)
+    top = open_backing(workdir, 'top', shape, dtype=np.int8)
+    xv2 = open_backing(workdir, 'xv2', shape)
+    yv2 = open_backing(workdir, 'yv2', shape)
+    zv2 = open_backing(workdir, 'zv2', shape)
+    ph = np.asarray(ph)
+    fsee_last = None
+
+    for rows, cols in chunked.blocks():
+        surf, local = chunked.halo(rows, cols)
+        ilo, i, ihi, jlo, j, jhi = local
+        _, xv, yv, zv = surf
+
+        # Rotate the extended block into the observer frame, as DiskGeometry.observer_frame
+        erows = np.arange(rows.start - 1, rows.stop + 1) % chunked.npoints
+        phf = ph[erows] - phio
+        xvf = xv * np.cos(2.0 * np.pi * phf)[:, None] / np.cos(2.0 * np.pi * ph[erows])[:, None]
+        yvf = yv * np.sin(2.0 * np.pi * phf)[:, None] / np.sin(2.0 * np.pi * ph[erows])[:, None]
+        xe = xvf * np.cos(-obselev) - zv * np.sin(-obselev)
+        ze = zv * np.cos(-obselev) + xvf * np.sin(-obselev)
+
+        if chunked.geometry.analytic:
+            ox, oy, oz = observer_rotate(chunked.orient(rows, cols, surf, local), phio, obselev)
+        else:
+            ox, oy, oz = chunked.orient(rows, cols, (None, xe, yvf, ze), local)
+
+        top_b = np.sign(ox).astype(np.int8)
+        fsee = np.abs(ox) / np.sqrt(ox**2 + oy**2 + oz**2)
+        top_b[fsee < 0.1] = 0
+
+        top[rows, cols] = top_b
+        xv2[rows, cols] = xe[i][:, j]
+        yv2[rows, cols] = yvf[i][:, j]
+        zv2[rows, cols] = ze[i][:, j]
+        if rows.stop == chunked.npoints and cols.stop == chunked.nprof:
+            fsee_last = fsee[-1, -1]
+
+    iplot = maskit_sorted(chunked.nprof, chunked.npoints, xv2, yv2, zv2)
+    np.save(os.path.join(workdir, 'iplot.npy'), iplot.astype(np.int8))
+    iplot = np.load(os.path.join(workdir, 'iplot.npy'), mmap_mode='r')
+
+    chunked._visibility[key] = (top, fsee_last, iplot)
+    return chunked._visibility[key]
+
+
+def dtmpspec_chunked(chunked, labs, T, side, ph, phio, obselev, workdir=None):
+    """
+    Emission seen by the observer, summed block by block. Same intot, intotx, en and spec as the
+    slow (fast='n') path of dtmpspec, without the plots.
+
+    :param chunked: ChunkedDisk of the disk
+    :param labs, T, side: Absorbed luminosity, temperature and illuminated side (may be memory-mapped)
+    :param ph: Phi angles the disk was saved with
+    :param phio: Phase rotation of the disk
+    :param obselev: Observer elevation angle
+    :param workdir: Directory for the memory-mapped visibility arrays
+    :return: intot, intotx, en, spec
+    """
+    top, fsee, iplot = visibility_chunked(chunked, ph, phio, obselev, workdir)
+
+    # Array to hold the energy and spectral info, as in dtmpspec
+    enbins = 1000
+    emin = 0.001
+    emax = 100.0
+    keV = 1.6021E-9
+    en = np.logspace(np.log10(emin), np.log10(emax), enbins)
+    energ = en * keV
+    spec = np.zeros(enbins)
+    intot = 0.0
+
+    for rows, cols in chunked.blocks():
+        # Points that are not hidden and whose illuminated side faces us
+        seen = iplot[rows, cols] + top[rows, cols] * side[rows, cols] == 2
+        intens = fsee * labs[rows, cols][seen]
+        intot += np.sum(intens)
+        if intens.size:
+            spec += intens @ bbnorm_v(T[rows, cols][seen], energ)
+
+    xlo = 0.3
+    xhi = 0.7
+    endiff = np.diff(en)
+    spectot = np.sum(spec[:-1] * endiff)
+    ix = np.where((en >= xlo) & (en < xhi))[0]
+    specx = np.sum(spec[ix] * endiff[ix])
+
+    intotx = intot * specx / spectot
+
+    return intot, intotx, en, spec
+
+
+def load_dtemp(bdir, k):
+    """
+    Load the disk temperature profile of beam rotation k, saved either as dtemp_XXX.npz (dense, or
+    sparse with the illuminated cells only) or, in chunked mode, as memory-mapped .npy files in a
+    dtemp_XXX/ directory.
+
+    :param bdir: Run directory
+    :param k: Index of the beam rotation
+    :return: Mapping of the saved arrays
+    """
+    dtemp_dir = os.path.join(bdir, f'dtemp_{k:03d}')
+    if os.path.isdir(dtemp_dir):
+        return {name[:-4]: np.load(os.path.join(dtemp_dir, name), mmap_mode='r')
+                for name in os.listdir(dtemp_dir) if name.endswith('.npy')}
+    return np.load(os.path.join(bdir, f'dtemp_{k:03d}.npz'))
+
+
+def dtemp_field(dtemp, key):
+    """
+    Full (npoints, nprof) array of T, labs or side from a loaded disk temperature profile, also when it
+    was saved sparse (only the illuminated cells, see dtemp_cells).
+
+    :param dtemp: Mapping returned by load_dtemp
+    :param key: 'T', 'labs' or 'side'
+    :return: Array of shape (npoints, nprof)
+    """
+    if 'index' not in dtemp:
+        return dtemp[key]
+    values = dtemp[key]
+    field = np.zeros(int(np.prod(dtemp['shape'])), dtype=values.dtype)
+    field[dtemp['index']] = values
+    return field.reshape(tuple(dtemp['shape']))
+
+
+def dtemp_cells(dtemp):
+    """
+    Illuminated cells of a disk temperature profile, the only ones where T and labs are non-zero.
+
+    :param dtemp: Mapping returned by load_dtemp, saved dense or sparse
+    :return: Flat indices of the cells into the (npoints, nprof) grid, and their labs, T and side
+    """
+    if 'index' in dtemp:
+        return dtemp['index'], dtemp['labs'], dtemp['T'], dtemp['side']
+    side = np.asarray(dtemp['side']).ravel()
+    index = np.flatnonzero(side)
+    return index, np.asarray(dtemp['labs']).ravel()[index], np.asarray(dtemp['T']).ravel()[index], side[index]
+
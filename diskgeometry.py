@@ -0,0 +1,424 @@
+import numpy as np
+from functools import cached_property
+from diskshape import diskshape_batch
+from diskmesh import adaptive_mesh
+from diskanalytic import analytic_disk
+from warpmodel import warp_from_params, warp_profiles
+from quadrature import disk_quadrature
+from maskit import maskit
+from diskshadow import horizon_shadow
+
+def nearest_index(values, grid):
+    """
+    Find the index of the nearest grid point for every value.
+
+    Same result as np.argmin(np.abs(value - grid)) for an ascending grid (ties go to the lower index),
+    but done with a binary search so it works on whole arrays at once.
+
+    :param values: Array of values to look up
+    :param grid: Ascending 1D grid
+    :return: Integer index array with the shape of values
+    """
+    values = np.asarray(values)
+    idx = np.clip(np.searchsorted(grid, values), 1, len(grid) - 1)
+    lo = idx - 1
+    pick_lo = np.abs(values - grid[lo]) <= np.abs(values - grid[idx])
+    return np.where(pick_lo, lo, idx)
+
+
+def interpolation_stencil(values, grid, interpolation, periodic=False):
+    """
+    Grid points and weights that interpolate a function on a 1D grid at every value.
+
+    'nearest' takes the nearest point (as nearest_index), 'bilinear' the two bracketing points and
+    'bicubic' four points with Catmull-Rom weights (which assume equally spaced points). Off a
+    non-periodic grid the end points are repeated; a periodic grid has its last point repeating the
+    first (as the phi grid of the beam patterns) and wraps around.
+
+    :param values: Array of values to interpolate at
+    :param grid: Ascending 1D grid
+    :param interpolation: 'nearest', 'bilinear' or 'bicubic'
+    :param periodic: Whether the grid spans exactly one period
+    :return: Index and weight arrays of shape values.shape + (k,), with k = 1, 2 or 4 points
+    """
+    values = np.asarray(values, dtype=float)
+    if interpolation == 'nearest':
+        return nearest_index(values, grid)[..., None], np.ones(values.shape + (1,))
+
+    # Cell of every value and the fractional position t in it
+    if periodic:
+        n = len(grid) - 1
+        period = grid[-1] - grid[0]
+        x = np.mod(values - grid[0], period) * n / period
+        i0 = np.minimum(np.floor(x).astype(int), n - 1)
+        t = x - i0
+    else:
+        n = len(grid)
+        i0 = np.clip(np.searchsorted(grid, values, side='right') - 1, 0, n - 2)
+        t = np.clip((values - grid[i0]) / (grid[i0 + 1] - grid[i0]), 0, 1)
+
+    if interpolation == 'bilinear':
+        offsets = np.arange(2)
+        weights = np.stack([1 - t, t], axis=-1)
+    elif interpolation == 'bicubic':
+        offsets = np.arange(-1, 3)
+        t2, t3 = t**2, t**3
+        weights = np.stack([(-t3 + 2 * t2 - t) / 2, (3 * t3 - 5 * t2 + 2) / 2,
+                            (-3 * t3 + 4 * t2 + t) / 2, (t3 - t2) / 2], axis=-1)
+    else:
+        raise ValueError(f"Unknown interpolation '{interpolation}'")
+
+    index = i0[..., None] + offsets
+    index = index % n if periodic else np.clip(index, 0, n - 1)
+    return index, weights
+
+
+def interpolate_grid(values, th_stencil, phi_stencil, batched=False):
+    """
+    Interpolate values on a (theta, phi) grid with the tensor product of two 1D stencils.
+
+    :param values: Array (..., nth, nphi)
+    :param th_stencil: Index and weight arrays from interpolation_stencil along theta
+    :param phi_stencil: Index and weight arrays along phi, broadcastable against th_stencil
+    :param batched: The stencils have a leading (nbatch,) axis matching the first axis of values
+    :return: Interpolated values, shape (..., *stencil shape)
+    """
+    ith, wth = th_stencil
+    iph, wph = phi_stencil
+    lead = (np.arange(values.shape[0]).reshape(-1, 1, 1),) if batched else (Ellipsis,)
+
+    out = 0.0
+    for a in range(ith.shape[-1]):
+        for b in range(iph.shape[-1]):
+            out = out + wth[..., a] * wph[..., b] * values[lead + (ith[..., a], iph[..., b])]
+    return out
+
+
+class DiskGeometry:
+    """
+    Shape of one disk (or a stack of disks) and everything derived from it that does not change
+    when the beam pattern rotates.
+
+    Build it once per disk and pass it to disktemp and dtmpspec. Every derived array is computed
+    the first time it is asked for and then kept.
+
+    :param npoints: Number of points in the disk (number of points that constitute the ring)
+    :param nprof: Number of profile points (number of which build up the warped disk)
+    :param disk_parameters: [rin, rout, tiltin, tiltout, phsoff], or an (nbatch, 5) stack of them
+    :param mesh: Optional non-uniform (ph, rfrac) mesh, e.g. from diskmesh.adaptive_mesh; npoints and
+                 nprof are then taken from it
+    :param analytic: Take normals, areas and solid angles from the closed-form surface (diskanalytic)
+                     instead of differences between neighbouring grid points
+    :param warp: Optional WarpModel giving tilt(r) and twist(r) instead of the linear warp
+    :param quadrature: 'midpoint' (one cell per point), or 'simpson' / 'gauss' to weight the solid
+                       angle element at every node with another rule (implies analytic; 'gauss'
+                       places its own radial nodes). The lit-side step keeps all of them first order
+    :param shadow: 'profile' to find the lit side with a running max/min along every profile, or 'horizon'
+                   to use the horizon buffer of diskshadow, which also takes the lit part of every cell
+                   into its solid angle
+    :param shadowsample: Number of azimuths per cell of the horizon buffer
+    """
+
+    def __init__(self, npoints, nprof, disk_parameters, mesh=None, analytic=False, warp=None, quadrature='midpoint',
+                 shadow='profile', shadowsample=4):
+        self.disk_parameters = np.asarray(disk_parameters, dtype=float)
+        self.batched = self.disk_parameters.ndim == 2
+
+        # Quadrature weights (in phase and fractional radius), computed once per mesh
+        self.quadrature = quadrature
+        self.weights = None
+        if quadrature != 'midpoint':
+            if mesh is not None:
+                raise ValueError(f"The '{quadrature}' quadrature sets its own mesh")
+            mesh, self.weights = disk_quadrature(quadrature, npoints, nprof)
+            analytic = True
+
+        self.mesh = mesh
+        self.analytic = analytic
+        self.warp = warp
+        self.shadow = shadow
+        self.shadowsample = int(shadowsample)
+
+        if mesh is None:
+            self.npoints = int(npoints)
+            self.nprof = int(nprof)
+
+            # Same phases as diskshape
+            self.ph = np.linspace(0, 1, self.npoints, endpoint=False) + 0.0001
+            self.phistep = self.ph[1] - self.ph[0]
+        else:
+            self.ph = np.asarray(mesh[0])
+            self.npoints = len(self.ph)
+            self.nprof = len(mesh[1])
+
+            # Width in phase of the cell around every node, shape (npoints, 1)
+            self.phistep = (np.roll(self.ph, -1) - np.roll(self.ph, 1)) % 1.0 / 2
+            self.phistep = self.phistep[:, None]
+
+        self._illum_index = {}
+        self._observer_frame = {}
+        self._visibility = {}
+
+    def _unbatch(self, v):
+        return v if self.batched else v[0]
+
+    @cached_property
+    def shape(self):
+        """ang, xv, yv, zv of the disk, as returned by diskshape."""
+        return tuple(self._unbatch(v) for v in diskshape_batch(self.npoints, self.nprof, self.disk_parameters, self.mesh, self.warp))
+
+    @property
+    def ang(self):
+        return self.shape[0]
+
+    @property
+    def xv(self):
+        return self.shape[1]
+
+    @property
+    def yv(self):
+        return self.shape[2]
+
+    @property
+    def zv(self):
+        return self.shape[3]
+
+    @cached_property
+    def neighbours(self):
+        """Neighbour indices jlo, jhi in angle (clamped at the edges) and ilo, ihi in phi (periodic)."""
+        jlo = np.r_[0, np.arange(self.nprof - 1)]
+        jhi = np.r_[np.arange(1, self.nprof), self.nprof - 1]
+        ilo = np.roll(np.arange(self.npoints), 1)
+        ihi = np.roll(np.arange(self.npoints), -1)
+        return jlo, jhi, ilo, ihi
+
+    @cached_property
+    def rfrac(self):
+        """Fractional radii of the profile points (0 at rin, 1 at rout)."""
+        return np.linspace(0, 1, self.nprof) if self.mesh is None else np.asarray(self.mesh[1])
+
+    @cached_property
+    def exact(self):
+        """rv, ang, normal, area and solid angle elements of the closed-form surface."""
+        return analytic_disk(self.disk_parameters, self.ph, self.rfrac, self.warp)
+
+    @cached_property
+    def spans(self):
+        """
+        Radial and angular distance between the neighbours of every point, as used by the differences.
+        With a quadrature rule these are twice the weights, so that half of them is the cell width.
+        """
+        if self.weights is not None:
+            wph, wr = self.weights
+            p = np.atleast_2d(self.disk_parameters)
+            rspan = 2 * (p[:, 1] - p[:, 0])[:, None, None] * wr
+            thspan = 2 * 2 * np.pi * wph[:, None]
+            return rspan, thspan
+
+        jlo, jhi, ilo, ihi = self.neighbours
+        rv = warp_profiles(self.disk_parameters, self.rfrac, self.warp)[0]
+        rspan = (rv[:, jhi] - rv[:, jlo])[:, None, :]
+        thspan = 2 * np.pi * ((self.ph[ihi] - self.ph[ilo]) % 1.0)[:, None]
+        return rspan, thspan
+
+    @cached_property
+    def orient(self):
+        """Cross product of the neighbour vectors along the profile and around the ring, shape (3, ...)."""
+        if self.analytic:
+            # Exact normal scaled by the same neighbour spans, so the areas keep the same convention
+            rspan, thspan = self.spans
+            return self._unbatch_vec(self.exact[2] * rspan * thspan)
+        return cross_product_grid(self.xv, self.yv, self.zv, *self.neighbours)
+
+    def _unbatch_vec(self, v):
+        return v if self.batched else v[:, 0]
+
+    @cached_property
+    def area(self):
+        """Patch areas in units of the inner radius squared (multiply by rinphys**2)."""
+        ox, oy, oz = self.orient
+        return np.sqrt(ox**2 + oy**2 + oz**2)
+
+    @cached_property
+    def sang(self):
+        """Solid angle of every patch seen from the central source."""
+        if self.analytic:
+            sang = self._unbatch(self.analytic_sang(self.exact[4]))
+        else:
+            jlo, jhi, _, _ = self.neighbours
+            ang = self.ang
+            sang = np.abs((2 * np.pi * self.phistep) * (ang[..., jhi] - ang[..., jlo]) / 2 * np.cos(ang))
+
+        # Only the unshadowed part of a lit patch receives light
+        if self.shadow == 'horizon':
+            side, fraction = self.horizon
+            sang = np.where(side != 0, sang * fraction, sang)
+        return sang
+
+    def analytic_sang(self, dO, rows=slice(None), cols=slice(None)):
+        """
+        Solid angle of the patches from the closed-form solid angle element.
+
+        :param dO: Solid angle element per unit dr dth, (nbatch, len(rows), len(cols))
+        :param rows, cols: Block of the grid dO is given on
+        """
+        rspan, thspan = self.spans
+        if self.weights is not None:
+            return dO * rspan[..., cols] / 2 * thspan[rows] / 2
+        return 2 * np.pi * np.broadcast_to(self.phistep, (self.npoints, 1))[rows] * dO * rspan[..., cols] / 2
+
+    @cached_property
+    def horizon(self):
+        """Lit side and lit fraction of every cell from the horizon buffer of diskshadow."""
+        return horizon_shadow(self, self.shadowsample)
+
+    @cached_property
+    def side(self):
+        """1 (-1) where the top (bottom) of the disk is illuminated, 0 where it is hidden further in."""
+        if self.shadow == 'horizon':
+            return self.horizon[0]
+        ang = self.ang
+        side = np.zeros(ang.shape, dtype=int)
+        anghi = np.maximum.accumulate(ang, axis=-1)
+        anglo = np.minimum.accumulate(ang, axis=-1)
+        side[..., 1:][ang[..., 1:] > anghi[..., :-1]] = 1
+        side[..., 1:][ang[..., 1:] < anglo[..., :-1]] = -1
+        return side
+
+    def illum_index(self, thbeam, phbeam):
+        """
+        Indices of the beam grid cell nearest to every disk point.
+
+        :param thbeam: Theta grid of the beam pattern
+        :param phbeam: Phi grid of the beam pattern
+        :return: disk_illum_th with the shape of ang, disk_illum_phi broadcastable against it
+        """
+        key = (np.asarray(thbeam).tobytes(), np.asarray(phbeam).tobytes())
+        if key not in self._illum_index:
+            disk_illum_phi = nearest_index(2 * np.pi * self.ph, phbeam)[:, None]
+            disk_illum_th = nearest_index(self.ang, thbeam)
+            self._illum_index[key] = (disk_illum_th, disk_illum_phi)
+        return self._illum_index[key]
+
+    def illum_stencil(self, thbeam, phbeam, interpolation):
+        """
+        Beam grid points and weights interpolating the illumination at every disk point, periodic in phi.
+
+        :param thbeam: Theta grid of the beam pattern
+        :param phbeam: Phi grid of the beam pattern (its last point repeating the first)
+        :param interpolation: 'nearest', 'bilinear' or 'bicubic'
+        :return: Theta and phi stencils for interpolate_grid
+        """
+        key = (np.asarray(thbeam).tobytes(), np.asarray(phbeam).tobytes(), interpolation)
+        if key not in self._illum_index:
+            th_stencil = interpolation_stencil(self.ang, thbeam, interpolation)
+            phi_stencil = interpolation_stencil(2 * np.pi * self.ph[:, None], phbeam, interpolation,
+                                                periodic=interpolation != 'nearest')
+            self._illum_index[key] = (th_stencil, phi_stencil)
+        return self._illum_index[key]
+
+    def observer_frame(self, ph, phio, obselev):
+        """
+        Disk coordinates rotated by phio in phi and tilted to the observer elevation, as in dtmpspec.
+
+        :param ph: Phi angles the disk was saved with
+        :param phio: Phase rotation of the disk
+        :param obselev: Observer elevation angle
+        :return: xv2, yv2, zv2
+        """
+        key = (np.asarray(ph).tobytes(), float(phio), float(obselev))
+        if key not in self._observer_frame:
+            phf = ph - phio
+            xvf = self.xv * np.cos(2.0 * np.pi * phf)[:, None] / np.cos(2.0 * np.pi * ph)[:, None]
+            yvf = self.yv * np.sin(2.0 * np.pi * phf)[:, None] / np.sin(2.0 * np.pi * ph)[:, None]
+            xv2 = xvf * np.cos(-obselev) - self.zv * np.sin(-obselev)
+            zv2 = self.zv * np.cos(-obselev) + xvf * np.sin(-obselev)
+            self._observer_frame[key] = (xv2, yvf, zv2)
+        return self._observer_frame[key]
+
+    def visibility(self, ph, phio, obselev):
+        """
+        Which way every patch faces the observer and which patches are not hidden behind the disk.
+
+        :param ph: Phi angles the disk was saved with
+        :param phio: Phase rotation of the disk
+        :param obselev: Observer elevation angle
+        :return: top (+1/-1 toward/away from the observer, 0 when seen edge-on), fsee (fraction of
+                 the area facing the observer), iplot (mask from maskit)
+        """
+        key = (np.asarray(ph).tobytes(), float(phio), float(obselev))
+        if key not in self._visibility:
+            xv2, yv2, zv2 = self.observer_frame(ph, phio, obselev)
+            if self.analytic:
+                ox, oy, oz = observer_rotate(self.orient, phio, obselev)
+            else:
+                ox, oy, oz = cross_product_grid(xv2, yv2, zv2, *self.neighbours)
+            top = np.sign(ox).astype(int)
+
+            # This is the fractional component of the area pointed toward us
+            fsee = np.abs(ox) / np.sqrt(ox**2 + oy**2 + oz**2)
+            top[fsee < 0.1] = 0
+
+            iplot = maskit(self.nprof, self.npoints, xv2, yv2, zv2)
+            self._visibility[key] = (top, fsee, iplot)
+        return self._visibility[key]
+
+
+def disk_geometry_from_params(params):
+    """
+    Build the DiskGeometry described by the contents of a par.npz file.
+
+    :param params: Loaded par.npz (or any mapping with the same keys)
+    :return: DiskGeometry
+    """
+    disk_parameters = [params['rin'], params['rout'], params['tiltin'], params['tiltout'], params['phsoff']]
+    warp = warp_from_params(params)
+
+    mesh = None
+    if 'mesh' in params and str(params['mesh']) == 'adaptive':
+        mesh = adaptive_mesh(disk_parameters, tol=float(params['meshtol']), npoints=int(params['npoints']),
+                             nprof=int(params['nprof']), warp=warp)
+
+    analytic = 'normals' in params and str(params['normals']) == 'analytic'
+    quadrature = str(params['quadrature']) if 'quadrature' in params else 'midpoint'
+    shadow = str(params['shadow']) if 'shadow' in params else 'profile'
+    shadowsample = int(params['shadowsample']) if 'shadowsample' in params else 4
+
+    return DiskGeometry(params['npoints'], params['nprof'], disk_parameters, mesh=mesh, analytic=analytic, warp=warp,
+                        quadrature=quadrature, shadow=shadow, shadowsample=shadowsample)
+
+
+def observer_rotate(vec, phio, obselev):
+    """
+    Turn vectors attached to the disk into the observer frame used by dtmpspec
+    (rotation by phio in phase, then tilt to the observer elevation).
+
+    :param vec: Array of shape (3, ...)
+    :param phio: Phase rotation of the disk
+    :param obselev: Observer elevation angle
+    :return: Rotated x, y, z components
+    """
+    rot = 2.0 * np.pi * phio
+    x1 = vec[0] * np.cos(rot) + vec[1] * np.sin(rot)
+    y1 = -vec[0] * np.sin(rot) + vec[1] * np.cos(rot)
+    x2 = x1 * np.cos(-obselev) - vec[2] * np.sin(-obselev)
+    z2 = vec[2] * np.cos(-obselev) + x1 * np.sin(-obselev)
+    return x2, y1, z2
+
+
+def cross_product_grid(xv, yv, zv, jlo, jhi, ilo, ihi):
+    """
+    Cross product of the neighbour vectors along the profile and around the ring at every grid point.
+
+    :param xv, yv, zv: Coordinates of the disk, (..., npoints, nprof)
+    :param jlo, jhi: Neighbour indices along the profile
+    :param ilo, ihi: Neighbour indices around the ring
+    :return: Array of shape (3, ...) with the x, y and z components
+    """
+    v1 = [c[..., jhi] - c[..., jlo] for c in (xv, yv, zv)]
+    v2 = [c[..., ihi, :] - c[..., ilo, :] for c in (xv, yv, zv)]
+    return np.array([
+        v1[1] * v2[2] - v1[2] * v2[1],
+        v1[2] * v2[0] - v1[0] * v2[2],
+        v1[0] * v2[1] - v1[1] * v2[0]
+    ])
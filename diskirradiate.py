@@ -0,0 +1,236 @@
+"""
+Re-irradiation of the disk by its own emission, with hierarchical view factors.
+
+Every lit cell re-emits what it absorbs as a Lambertian emitter on its lit face, and a fraction
+    F_ij = A_i cos(theta_j) cos(theta_i) / (pi d_ij^2)
+of the emission of cell j is absorbed by cell i. The absorbed luminosities then solve
+L = L_direct + F L, iterated to convergence.
+
+Occlusion is not modelled: cells that face each other exchange light even when the disk lies
+between them, so on warped disks the re-irradiation (and labs, T and lemit with it) is an upper
+bound; on the default disk it adds about 28% to lemit, about 63% with a 60 degree outer tilt.
+
+The view factors are summed Barnes-Hut style: the lit cells are put in a k-d tree, and a group of
+cells that looks small from a target cell (radius < theta times distance) acts through the summed
+moments sum(L_j n_j) of its cells facing up and down, expanded about their centres of emission. The
+clamped cosines only add up if every cell of the group is seen from the same side and sees the
+target from the same side, so groups whose cone of normals (widened by the angle they subtend)
+straddles the direction to the target are opened as well. Nearby leaves are summed cell by cell.
+
+The interaction lists only depend on the geometry, so they are built once per disk. Cells seen at
+grazing angles keep the cone test from accepting groups close to them, so the number of pairs per
+cell grows roughly as the square root of the number of cells. On the default disk (48x40) theta=0.2
+gives labs within 0.4% of the exact sum (theta=0) for every cell and the re-irradiated part within
+0.8%.
+"""
+import numpy as np
+
+
+class ViewFactorTree:
+    """
+    Interaction lists of the hierarchical view-factor sum for the lit cells of one disk.
+
+    :param geometry: DiskGeometry of a single disk
+    :param theta: Opening angle; groups with radius < theta times their distance use their moments
+                  (0 sums every pair of cells exactly)
+    :param leafsize: Largest number of cells in a leaf of the tree
+    """
+
+    def __init__(self, geometry, theta=0.2, leafsize=8):
+        if geometry.batched:
+            raise ValueError("Re-irradiation needs the geometry of a single disk")
+        side = geometry.side
+        self.lit = side != 0
+        self.theta = theta
+
+        # Position, area and unit normal of the lit face of every lit cell. The patch areas of the
+        # geometry span the neighbours on both sides in each direction, four times the cell itself
+        self.pos = np.stack([geometry.xv[self.lit], geometry.yv[self.lit], geometry.zv[self.lit]], axis=1)
+        self.area = geometry.area[self.lit]
+        self.cell_area = self.area / 4
+        self.normal = side[self.lit][:, None] * np.stack([o[self.lit] for o in geometry.orient], axis=1) / self.area[:, None]
+        self.up = side[self.lit] > 0
+
+        self._build_tree(leafsize)
+        self._interactions()
+
+    def _build_tree(self, leafsize):
+        """k-d tree with median splits along the widest axis; every node is a range of perm."""
+        ncell = len(self.area)
+        perm = np.arange(ncell)
+        start, end, children = [0], [ncell], [None]
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if end[node] - start[node] <= leafsize:
+                continue
+            pts = self.pos[perm[start[node]:end[node]]]
+            axis = np.argmax(np.ptp(pts, axis=0))
+            perm[start[node]:end[node]] = perm[start[node]:end[node]][np.argsort(pts[:, axis], kind='stable')]
+            mid = (start[node] + end[node]) // 2
+            children[node] = (len(start), len(start) + 1)
+            start += [start[node], mid]
+            end += [mid, end[node]]
+            children += [None, None]
+            stack += list(children[node])
+
+        self.perm = perm
+        self.start = np.array(start)
+        self.end = np.array(end)
+        self.children = children
+
+        # Centre and radius of every node, and the cone (axis and half-angle) of the normals of its cells
+        # facing up and down (half-angle -1 for an empty group)
+        nnode = len(start)
+        self.center = np.zeros((nnode, 3))
+        self.radius = np.zeros(nnode)
+        self.cone_axis = np.zeros((2, nnode, 3))
+        self.cone_angle = np.full((2, nnode), -1.0)
+        for node in range(nnode):
+            cells = perm[start[node]:end[node]]
+            pts = self.pos[cells]
+            self.center[node] = np.mean(pts, axis=0)
+            self.radius[node] = np.max(np.linalg.norm(pts - self.center[node], axis=1))
+            for f, facing in enumerate((self.up[cells], ~self.up[cells])):
+                normals = self.normal[cells[facing]]
+                if len(normals):
+                    axis = np.sum(normals, axis=0)
+                    axis /= np.linalg.norm(axis)
+                    self.cone_axis[f, node] = axis
+                    self.cone_angle[f, node] = np.max(np.arccos(np.clip(normals @ axis, -1, 1)))
+
+    def _interactions(self, block=1024):
+        """Walk the tree for blocks of target cells and keep the far (cell, node) and near (cell, cell) pairs."""
+        ncell = len(self.area)
+        is_leaf = np.array([c is None for c in self.children])
+        child = np.array([c if c is not None else (-1, -1) for c in self.children])
+
+        far_t, far_n, near_target, near_source, near_factor = [], [], [], [], []
+        for first in range(0, ncell, block):
+            targets = np.arange(first, min(first + block, ncell))
+            nodes = np.zeros(len(targets), dtype=int)
+            near_t, near_n = [], []
+            while len(targets):
+                r = self.pos[targets] - self.center[nodes]
+                dist = np.linalg.norm(r, axis=1)
+                far = self.radius[nodes] < self.theta * dist
+
+                # The moments only add up if every cell of the node faces the target from the same side, and
+                # the target sees every cell from the same side: the normals, widened by the angle the node
+                # subtends, must stay clear of the plane perpendicular to the direction of the node
+                rhat = r / np.where(dist > 0, dist, 1.0)[:, None]
+                spread = np.arcsin(np.minimum(self.radius[nodes] / np.where(dist > 0, dist, 1.0), 1.0))
+                for f in range(2):
+                    angle = self.cone_angle[f, nodes]
+                    cos_axis = np.abs(np.sum(self.cone_axis[f, nodes] * rhat, axis=1))
+                    far &= (angle < 0) | (cos_axis > np.sin(np.minimum(angle + spread, np.pi / 2)))
+                far &= np.abs(np.sum(self.normal[targets] * rhat, axis=1)) > np.sin(spread)
+                far_t.append(targets[far])
+                far_n.append(nodes[far])
+
+                leaf = ~far & is_leaf[nodes]
+                near_t.append(targets[leaf])
+                near_n.append(nodes[leaf])
+
+                open_ = ~far & ~is_leaf[nodes]
+                targets = np.repeat(targets[open_], 2)
+                nodes = child[nodes[open_]].ravel()
+
+            t, j, factor = self._near_pairs(np.concatenate(near_t), np.concatenate(near_n))
+            near_target.append(t)
+            near_source.append(j)
+            near_factor.append(factor)
+
+        # Far pairs: the geometry depends on the centre of emission of the node, which moves with L
+        self.far_target = np.concatenate(far_t)
+        self.far_node = np.concatenate(far_n)
+
+        self.near_target = np.concatenate(near_target)
+        self.near_source = np.concatenate(near_source)
+        self.near_factor = np.concatenate(near_factor)
+
+    def _near_pairs(self, t, n):
+        """Exact view factors from every cell of the leaves n to the target cells t (except the targets themselves)."""
+        counts = self.end[n] - self.start[n]
+        offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = self.perm[np.repeat(self.start[n], counts) + offsets]
+        t = np.repeat(t, counts)
+        keep = j != t
+        t, j = t[keep], j[keep]
+        r = self.pos[t] - self.pos[j]
+        d2 = np.sum(r**2, axis=1)
+        rhat = r / np.sqrt(d2)[:, None]
+        cos_e = np.maximum(np.sum(self.normal[j] * rhat, axis=1), 0)
+        cos_r = np.maximum(-np.sum(self.normal[t] * rhat, axis=1), 0)
+        nonzero = cos_e * cos_r > 0
+        return t[nonzero], j[nonzero], (self.cell_area[t] * cos_e * cos_r / (np.pi * d2))[nonzero]
+
+    def absorbed(self, L, block=1 << 20):
+        """
+        Luminosity every lit cell absorbs from the emission of the others.
+
+        :param L: Luminosity emitted by every lit cell, (nlit,)
+        :param block: Number of far pairs evaluated at once
+        :return: Absorbed luminosity, (nlit,)
+        """
+        ncell = len(self.area)
+        out = np.bincount(self.near_target, weights=self.near_factor * L[self.near_source], minlength=ncell)
+
+        # Moments sum(L n), luminosities and centres of emission of the cells facing up and down in every
+        # node, from cumulative sums along perm; expanding about the centre of emission (rather than the
+        # centre of the node) cancels the error of first order in the size of the node
+        Lperm = L[self.perm]
+        up = self.up[self.perm]
+        for facing in (up, ~up):
+            Lf = np.where(facing, Lperm, 0.0)
+            csum = np.cumsum(np.column_stack([Lf[:, None] * self.normal[self.perm], Lf, Lf[:, None] * self.pos[self.perm]]),
+                             axis=0)
+            csum = np.concatenate([np.zeros((1, 7)), csum])
+            sums = csum[self.end] - csum[self.start]
+            moment, lum = sums[:, :3], sums[:, 3]
+            centre = np.where(lum[:, None] > 0, sums[:, 4:] / np.where(lum > 0, lum, 1.0)[:, None], self.center)
+
+            for start in range(0, len(self.far_target), block):
+                t = self.far_target[start:start + block]
+                node = self.far_node[start:start + block]
+                r = self.pos[t] - centre[node]
+                d2 = np.sum(r**2, axis=1)
+                rhat = r / np.sqrt(d2)[:, None]
+                emitted = np.maximum(np.sum(moment[node] * rhat, axis=1), 0)
+                received = np.maximum(-np.sum(self.normal[t] * rhat, axis=1), 0)
+                out += np.bincount(t, weights=self.cell_area[t] * received * emitted / (np.pi * d2), minlength=ncell)
+        return out
+
+
+def reirradiate(tree, rinphys, labs, tol=1e-8, maxiter=100):
+    """
+    Absorbed luminosity and temperature of the disk including its re-irradiation. Occlusion by the
+    disk is ignored, so on warped disks these are upper bounds.
+
+    :param tree: ViewFactorTree of the disk
+    :param rinphys: Inner physical radius
+    :param labs: Luminosity absorbed directly from the source, (npoints, nprof)
+    :param tol: Relative change of the luminosities at which the iteration stops
+    :param maxiter: Largest number of iterations
+    :return: T, labs (direct plus re-irradiation) and lemit
+    """
+
+    # PHYSICAL CONSTANTS--------
+    SBsigma = 5.6705E-5  # Stefan-Boltzmann constant in erg/(cm^2 K^4 s)
+
+    L_direct = labs[tree.lit]
+    L = L_direct
+    for _ in range(maxiter):
+        L_next = L_direct + tree.absorbed(L)
+        converged = np.max(np.abs(L_next - L)) <= tol * np.max(np.abs(L_next))
+        L = L_next
+        if converged:
+            break
+
+    labs = np.zeros(tree.lit.shape)
+    labs[tree.lit] = L
+    T = np.zeros(tree.lit.shape)
+    T[tree.lit] = (1E38)**(1/4) * (L / (SBsigma * rinphys**2 * tree.area))**(1/4)
+
+    return T, labs, np.sum(labs)
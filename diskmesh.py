@@ -0,0 +1,123 @@
+import numpy as np
+from diskanalytic import analytic_disk
+from diskshadow import horizon_side
+
+def line_errors(I, J, ang, dO, rv, table, nprobe):
+    """
+    Error of the lit solid angle of a mesh, summed along its rows and along its columns.
+
+    Every mesh cell is counted lit or shadowed as a whole, from the side of its node, as in DiskGeometry.
+    It is compared with the lit solid angle the probe grid holds over the same cell.
+
+    :param I: Probe indices of the mesh phases (starting at 0)
+    :param J: Probe indices of the mesh radii (including both ends)
+    :param ang, dO, rv: Disk angle and solid angle element on the probe grid, and the probe radii
+    :param table: Running sums of the lit solid angle of the probe cells, over two turns in phase
+    :param nprobe: Resolution of the probe grid
+    :return: error of every row (phase), error of every column (radius), both signed
+    """
+    h = 1.0 / nprobe
+    prev_I, next_I = np.r_[I[-1] - nprobe, I[:-1]], np.r_[I[1:], I[0] + nprobe]
+    prev_J, next_J = np.r_[J[0], J[:-1]], np.r_[J[1:], J[-1]]
+
+    # Lit solid angle over every mesh cell. The cells end halfway between the nodes, which is either on
+    # the edge of a probe cell or across its middle; the phase cells are shifted by a turn, so none wraps
+    lo = prev_I + I + 2 * nprobe
+    ends = np.r_[lo, lo[0] + 2 * nprobe]
+    rows = np.diff((table[(ends + 1) // 2] + table[(ends + 2) // 2]) / 2, axis=0)
+    mid = J[:-1] + J[1:]
+    cols = np.hstack([rows[:, :1], (rows[:, (mid + 1) // 2] + rows[:, (mid + 2) // 2]) / 2, rows[:, -1:]])
+    exact = np.diff(cols, axis=1)
+
+    # What the mesh makes of it, with the lit side found on the mesh itself
+    lit = horizon_side(ang[np.ix_(I, J)], np.broadcast_to(rv[J], (len(I), len(J)))) != 0
+    size = ((next_I - prev_I) * h / 2)[:, None] * ((next_J - prev_J) / (nprobe - 1) / 2)
+    mesh = np.where(lit, dO[np.ix_(I, J)], 0.0) * size
+
+    error = mesh - exact
+    return error.sum(axis=1), error.sum(axis=0)
+
+
+def bisect(nodes, errors, worst, room, period=None):
+    """
+    Halve the intervals on both sides of the nodes whose line error is within a factor 2 of the worst.
+
+    :param nodes: Ascending probe indices of the nodes
+    :param errors: Error of the line through every node
+    :param worst: Largest line error of the mesh
+    :param room: Number of nodes that can still be added; only the worst lines are halved when it is short
+    :param period: Number of probe points per period for periodic nodes, None for nodes with two ends
+    :return: Refined nodes (intervals of a single probe step are left as they are)
+    """
+    marked = np.flatnonzero(errors >= worst / 2)
+    marked = marked[np.argsort(errors[marked])[::-1][:room // 2]]
+    if period is None:
+        prev_n, next_n = np.r_[nodes[0], nodes[:-1]], np.r_[nodes[1:], nodes[-1]]
+    else:
+        prev_n, next_n = np.r_[nodes[-1] - period, nodes[:-1]], np.r_[nodes[1:], nodes[0] + period]
+    new = np.r_[(prev_n + nodes)[marked] // 2, (nodes + next_n)[marked] // 2]
+    if period is not None:
+        new %= period
+    return np.unique(np.r_[nodes, new])
+
+
+def adaptive_mesh(disk_parameters, tol=3e-2, npoints=100, nprof=100, nmin=8, nprobe=512, warp=None):
+    """
+    Build a non-uniform mesh in phase and radius that puts the nodes where the absorbed luminosity is
+    integrated worst.
+
+    Most of the error of the cells comes from the edge of the lit side, where the solid angle seen from
+    the source steps to zero: a cell is lit or shadowed as a whole. Where such a step runs along a row or
+    column of the mesh the errors of its cells add up; this is always the case at the inner edge, whose
+    first node is never lit. Where it cuts across them, they mostly cancel. The lit solid angle is
+    therefore integrated on a fine probe grid, every cell of the mesh is compared with it, and the rows
+    and columns with the largest summed error are halved until the errors of all the rows, and of all the
+    columns, add up to no more than tol of the total. Starts from nmin cells in each direction.
+
+    :param disk_parameters: Array of parameters [rin, rout, tiltin, tiltout, phsoff]
+    :param tol: Target relative error of the lit solid angle (the luminosity absorbed from an isotropic
+                source), summed over the rows and over the columns of the mesh. The cells cannot get smaller
+                than the probe grid, so the mesh stops at npoints x nprof when tol is below what it resolves
+    :param npoints: Largest number of points allowed in phase
+    :param nprof: Largest number of profile points allowed in radius
+    :param nmin: Smallest number of cells in each direction
+    :param nprobe: Resolution of the probe grid in each direction; the mesh nodes are probe points
+    :param warp: Optional WarpModel of the disk
+    :return: ph (phases, as used by diskshape), rfrac (fractional radii, 0 at rin and 1 at rout)
+    """
+
+    # Probe the disk on a fine uniform grid
+    php = np.arange(nprobe) / nprobe
+    rp = np.linspace(0, 1, nprobe)
+    rv, ang, _, _, dO = analytic_disk(disk_parameters, php, rp, warp)
+    rv, ang, dO = rv[0], ang[0], dO[0]
+
+    # Lit solid angle of the probe cells; the innermost ring is lit like the ring next to it
+    lit = horizon_side(ang, np.broadcast_to(rv, ang.shape)) != 0
+    lit[:, 0] = lit[:, 1]
+    width = np.full(nprobe, 1.0 / (nprobe - 1))
+    width[[0, -1]] /= 2
+    cells = np.where(lit, dO, 0.0) * width / nprobe
+    table = np.zeros((2 * nprobe + 1, nprobe + 1))
+    table[1:, 1:] = np.cumsum(np.cumsum(np.concatenate([cells, cells]), axis=0), axis=1)
+    total = table[nprobe, nprobe]
+
+    I = np.unique(np.round(np.arange(nmin) * nprobe / nmin).astype(int))
+    J = np.unique(np.round(np.linspace(0, nprobe - 1, nmin + 1)).astype(int))
+    while True:
+        eph, er = (np.abs(e) for e in line_errors(I, J, ang, dO, rv, table, nprobe))
+        if max(eph.sum(), er.sum()) <= tol * total:
+            break
+
+        # Halve the worst lines that can still be refined, within the resolution allowed
+        eph[((np.r_[I[1:], I[0] + nprobe] - I < 2) & (I - np.r_[I[-1] - nprobe, I[:-1]] < 2))
+            | (npoints - len(I) < 2)] = 0.0
+        er[((np.r_[J[1:], J[-1]] - J < 2) & (J - np.r_[J[0], J[:-1]] < 2)) | (nprof - len(J) < 2)] = 0.0
+        worst = max(eph.max(), er.max())
+        if worst == 0.0:
+            break
+        I = bisect(I, eph, worst, npoints - len(I), nprobe)
+        J = bisect(J, er, worst, nprof - len(J))
+
+    # Offset as in diskshape to avoid division by zero
+    return php[I] + 0.0001, rp[J]
@@ -0,0 +1,123 @@
+"""
+Results of a run derived from a finished run that differs from it only in lum38 and rinphys.
+
+The illumination and every luminosity (labs, lemit, the star's and the disk's profiles) are
+proportional to lum38, and the temperatures to (lum38 / rinphys^2)^(1/4); the disk shape, the beam
+patterns, the lit side and the visibility do not depend on either. Only the spectra change shape, and
+they are summed again from the rescaled temperatures over the visible points saved by the reference
+run, without recomputing the geometry or the illumination.
+"""
+import glob
+import os
+import numpy as np
+from bbfrac import bbnorm_v
+from diskchunk import load_dtemp, dtemp_cells
+
+
+def rescale_factors(ref_params, params):
+    """
+    Scale factors of the luminosities and of the temperatures from one run to another.
+
+    :param ref_params: Loaded par.npz of the reference run
+    :param params: Loaded par.npz of the new run
+    :return: lscale, tscale
+    """
+    lscale = float(params['lum38']) / float(ref_params['lum38'])
+    tscale = (lscale * (float(ref_params['rinphys']) / float(params['rinphys']))**2)**(1/4)
+    return lscale, tscale
+
+
+def rescale_run(refdir, bdir, block=4096):
+    """
+    Write the disk temperatures, emitted luminosities, profiles and spectra of the run in bdir by
+    rescaling those of the run in refdir (as saved by disktempsave and diskspecrest).
+
+    :param refdir: Directory of the finished reference run
+    :param bdir: Directory of the new run, with its par.npz
+    :param block: Number of visible points whose spectra are summed at once
+    """
+    ref_params = np.load(os.path.join(refdir, 'par.npz'))
+    params = np.load(os.path.join(bdir, 'par.npz'))
+
+    # Everything but the luminosity and the physical radius must be the same
+    for key in set(ref_params.keys()) | set(params.keys()):
+        if key in ('lum38', 'rinphys', 'reference'):
+            continue
+        if key not in ref_params or key not in params or not np.array_equal(ref_params[key], params[key]):
+            raise ValueError(f"{bdir} differs from {refdir} in '{key}' and cannot be rescaled from it")
+
+    lscale, tscale = rescale_factors(ref_params, params)
+    nang = int(params['nang'])
+    scale = {'illum': lscale, 'labs': lscale, 'T': tscale}
+
+    # The normalized beam patterns do not change
+    diskbeam = dict(np.load(os.path.join(refdir, 'diskbeam.npz'), allow_pickle=True))
+    diskbeam['rinphys'] = params['rinphys']
+    np.savez(os.path.join(bdir, 'diskbeam.npz'), **diskbeam)
+
+    # Disk temperature profiles, as dtemp_XXX.npz or (chunked) dtemp_XXX/ directories
+    for k in range(nang):
+        dtemp = load_dtemp(refdir, k)
+        values = {key: dtemp[key] * scale[key] if key in scale else dtemp[key] for key in dtemp.keys()}
+        if os.path.isdir(os.path.join(refdir, f'dtemp_{k:03d}')):
+            dtemp_dir = os.path.join(bdir, f'dtemp_{k:03d}')
+            os.makedirs(dtemp_dir, exist_ok=True)
+            for key, value in values.items():
+                np.save(os.path.join(dtemp_dir, f'{key}.npy'), value)
+        else:
+            np.savez(os.path.join(bdir, f'dtemp_{k:03d}.npz'), **values)
+
+    lemitv = np.load(os.path.join(refdir, 'lemit.npz'))['lemitv']
+    np.savez(os.path.join(bdir, 'lemit.npz'), lemitv=lemitv * lscale)
+
+    # Profiles and spectra of every view of the disk
+    keV = 1.6021E-9
+    for refview in sorted(glob.glob(os.path.join(refdir, 'diskphi_*'))):
+        view = os.path.join(bdir, os.path.basename(refview))
+        os.makedirs(view, exist_ok=True)
+        diskvf_path = os.path.join(refview, 'diskvf.npz')
+        if os.path.exists(diskvf_path):
+            diskvf = np.load(diskvf_path)
+            np.savez(os.path.join(view, 'diskvf.npz'), **diskvf)
+        else:
+            # Chunked runs keep the mask and the visible side of the view as .npy files
+            for name in ('iplot.npy', 'top.npy'):
+                np.save(os.path.join(view, name), np.load(os.path.join(refview, name), mmap_mode='r'))
+
+        inprof = np.load(os.path.join(refview, 'inprof.npz'))
+        inrep = inprof['inrep'] * lscale
+        inrepx = np.zeros(nang)
+        for j in range(nang):
+            index, labs, T, side = dtemp_cells(load_dtemp(refdir, j))
+
+            # Illuminated points the observer sees, as saved by dtmpspec (or dtmpspec_chunked)
+            if os.path.exists(diskvf_path):
+                seen = (diskvf['iplot'] + diskvf['see'] == 2).ravel()[index]
+            else:
+                iplot = np.load(os.path.join(refview, 'iplot.npy'), mmap_mode='r')
+                top = np.load(os.path.join(refview, 'top.npy'), mmap_mode='r')
+                seen = np.asarray(iplot).ravel()[index] + np.asarray(top).ravel()[index] * side == 2
+
+            # Every visible point has the same fraction fsee of its labs in the profile
+            labs_seen = labs[seen] * lscale
+            T_seen = T[seen] * tscale
+            fsee = inrep[j] / np.sum(labs_seen) if np.sum(labs_seen) > 0 else 0.0
+
+            en = np.load(os.path.join(refview, f'spec_{j:03d}.npz'))['en']
+            energ = en * keV
+            spec = np.zeros(len(en))
+            for start in range(0, len(labs_seen), block):
+                sl = slice(start, start + block)
+                spec += (fsee * labs_seen[sl]) @ bbnorm_v(T_seen[sl], energ)
+            np.savez(os.path.join(view, f'spec_{j:03d}.npz'), en=en, spec=spec)
+
+            xlo = 0.3
+            xhi = 0.7
+            endiff = np.diff(en)
+            spectot = np.sum(spec[:-1] * endiff)
+            ix = np.where((en >= xlo) & (en < xhi))[0]
+            specx = np.sum(spec[ix] * endiff[ix])
+
+            inrepx[j] = inrep[j] * specx / spectot
+
+        np.savez(os.path.join(view, 'inprof.npz'), inrep=inrep, inrepx=inrepx, instar=inprof['instar'] * lscale)
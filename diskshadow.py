@@ -0,0 +1,73 @@
+"""
+Shadowing of the disk from the central source with an angular horizon buffer.
+
+The buffer has one azimuth bin per half-plane of constant azimuth around the source. Within a bin the
+disk points are sorted by their distance to the source, and the running maximum (minimum) of their
+elevation is the upper (lower) horizon seen by the next point outward: a point is lit from the top
+(bottom) when it rises above (dips below) everything closer in, and shadowed otherwise. Sorting makes
+the buffer O(N log N) and independent of how the points are ordered on the grid.
+
+diskshape builds the surface in spherical coordinates about the source, so every row of the disk grid
+lies in one azimuth bin. Shadows from neighbouring azimuths fall across the cells of a twisted disk,
+so the surface is resampled at several azimuths per cell to find the part of every cell that is lit.
+"""
+import numpy as np
+from diskshape import disk_profiles, disk_surface
+
+
+def horizon_side(elevation, distance):
+    """
+    Illuminated side of points in the azimuth bins of a horizon buffer.
+
+    :param elevation: Elevation of the points above the plane of the source, (..., nbin, npts)
+    :param distance: Distance of the points to the source, same shape
+    :return: side, 1 (-1) where the top (bottom) is lit, 0 where shadowed (and for the innermost point)
+    """
+    order = np.argsort(distance, axis=-1, kind='stable')
+    el = np.take_along_axis(elevation, order, axis=-1)
+
+    # Upper and lower horizons left by the points closer in
+    anghi = np.maximum.accumulate(el, axis=-1)
+    anglo = np.minimum.accumulate(el, axis=-1)
+    side_sorted = np.zeros(el.shape, dtype=int)
+    side_sorted[..., 1:][el[..., 1:] > anghi[..., :-1]] = 1
+    side_sorted[..., 1:][el[..., 1:] < anglo[..., :-1]] = -1
+
+    side = np.empty_like(side_sorted)
+    np.put_along_axis(side, order, side_sorted, axis=-1)
+    return side
+
+
+def horizon_shadow(geometry, oversample=4):
+    """
+    Illuminated side and lit fraction of every cell of a disk.
+
+    :param geometry: DiskGeometry of the disk (mesh and warp are taken from it)
+    :param oversample: Number of azimuths per phase interval the surface is resampled at
+    :return: side of every cell (that of its grid point, as DiskGeometry.side, or else the side from
+             which the rest of the cell is lit), and the fraction of every cell lit from that side
+    """
+    ph, rv, tilt, off = disk_profiles(geometry.npoints, geometry.nprof, geometry.disk_parameters,
+                                      geometry.mesh, geometry.warp)
+
+    # Subdivide every phase interval; the first azimuth of each interval is the grid point itself
+    dph = (np.roll(ph, -1) - ph) % 1.0
+    ph_fine = (ph[:, None] + np.arange(oversample) / oversample * dph[:, None]).ravel()
+    ang, xv, yv, zv = disk_surface(ph_fine, rv, tilt, off)
+    distance = np.sqrt(xv**2 + yv**2 + zv**2)
+
+    nbatch = ang.shape[0]
+    side_fine = horizon_side(ang, distance).reshape(nbatch, geometry.npoints, oversample, geometry.nprof)
+
+    # A cell spans the first half of its own interval and the second half of the previous one
+    half = (oversample + 1) // 2
+    samples = np.concatenate([side_fine[:, :, :half], np.roll(side_fine[:, :, half:], 1, axis=1)], axis=2)
+
+    # A cell whose grid point is shadowed can still be partly lit by the light passing its neighbours
+    side = side_fine[:, :, 0]
+    side = np.where(side != 0, side, np.sign(np.sum(samples, axis=2)))
+    fraction = np.where(side != 0, np.mean(samples == side[:, :, None], axis=2), 0.0)
+
+    if not geometry.batched:
+        return side[0], fraction[0]
+    return side, fraction
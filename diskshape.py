@@ -1,6 +1,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
+from warpmodel import warp_profiles
 
 def diskshape(npoints, nprof, disk_parameters):
     """
@@ -11,34 +12,80 @@ def diskshape(npoints, nprof, disk_parameters):
     :param nprof: Number of profile points
     :return: ang, xv, yv, zv
     """
-    
-    # Parameters of the disk
-    rin, rout, tiltin, tiltout, phsoff = disk_parameters
 
-    # Offsets and amplitudes for the disk profile
-    off = np.linspace(0, phsoff, nprof)
-    tilt_angles = np.linspace(tiltin, tiltout, nprof)
+    # A single disk is a batch of one
+    ang, xv, yv, zv = diskshape_batch(npoints, nprof, [disk_parameters])
 
-    ang = np.zeros((npoints, nprof))
-    xv = np.zeros((npoints, nprof))
-    yv = np.zeros((npoints, nprof))
-    zv = np.zeros((npoints, nprof))
+    return ang[0], xv[0], yv[0], zv[0]
 
-    # Make the vector of radii
-    rv = np.linspace(rin, rout, nprof)
+def diskshape_batch(npoints, nprof, disk_parameters_v, mesh=None, warp=None):
+    """
+    Calculate the shape of a stack of disks in one vectorized pass.
+
+    :param npoints: Number of points for the disk profile
+    :param nprof: Number of profile points
+    :param disk_parameters_v: Array of shape (nbatch, 5), one [rin, rout, tiltin, tiltout, phsoff] per disk
+    :param mesh: Optional (ph, rfrac) node positions in phase and in fractional radius (0 at rin, 1 at rout)
+                 to use instead of the uniform grid; npoints and nprof are then taken from it
+    :param warp: Optional WarpModel giving tilt(r) and twist(r) instead of the linear warp
+    :return: ang, xv, yv, zv, each of shape (nbatch, npoints, nprof)
+    """
+
+    return disk_surface(*disk_profiles(npoints, nprof, disk_parameters_v, mesh, warp))
+
+def disk_profiles(npoints, nprof, disk_parameters_v, mesh=None, warp=None):
+    """
+    Phases and radial profiles (radius, tilt, twist) the disk surface is built from.
+
+    :param npoints, nprof, disk_parameters_v, mesh, warp: As for diskshape_batch
+    :return: ph (npoints,), rv, tilt_angles, off, each of shape (nbatch, nprof)
+    """
+
+    # Parameters of the disks, one row per disk
+    disk_parameters_v = np.atleast_2d(np.asarray(disk_parameters_v, dtype=float))
+    rin, rout, tiltin, tiltout, phsoff = disk_parameters_v.T
+
+    if mesh is None and warp is None:
+        # Offsets and amplitudes for the disk profiles, shape (nbatch, nprof)
+        off = np.linspace(0, phsoff, nprof, axis=-1)
+        tilt_angles = np.linspace(tiltin, tiltout, nprof, axis=-1)
+
+        # Make the vectors of radii
+        rv = np.linspace(rin, rout, nprof, axis=-1)
+
+        # Find the appropriate values of phase to use
+        ph = np.linspace(0, 1, npoints, endpoint=False) + 0.0001  # Avoid division by zero
+    else:
+        if mesh is None:
+            mesh = (np.linspace(0, 1, npoints, endpoint=False) + 0.0001, np.linspace(0, 1, nprof))
+
+        # Tilt and twist of the warp model, evaluated at the mesh nodes
+        ph = np.asarray(mesh[0])
+        rv, tilt_angles, _, off, _ = warp_profiles(disk_parameters_v, mesh[1], warp)
+
+    return ph, rv, tilt_angles, off
+
+def disk_surface(ph, rv, tilt_angles, off):
+    """
+    Evaluate the disk surface on the grid of the given phases and profile points.
+
+    Every point only depends on its own phase and profile values, so any block of the grid
+    comes out exactly as it does in the full grid.
+
+    :param ph: Phases, (npoints,)
+    :param rv, tilt_angles, off: Radial profiles, (nbatch, nprof)
+    :return: ang, xv, yv, zv, each of shape (nbatch, npoints, nprof)
+    """
+
+    phv = 2 * np.pi * ph[None, :, None]
 
-    # Find the appropriate values of phase to use
-    ph = np.linspace(0, 1, npoints, endpoint=False) + 0.0001  # Avoid division by zero
-    
     # Fill in the angles of the profiles to plot
-    for i in range(npoints):
-        ang[i, :] = -tilt_angles * np.sin(2 * np.pi * ph[i] + off)
+    ang = -tilt_angles[:, None, :] * np.sin(phv + off[:, None, :])
 
     # Make the x, y, and z profiles
-    for i in range(npoints):
-        xv[i, :] = rv * np.cos(2 * np.pi * ph[i]) * np.cos(ang[i, :])
-        yv[i, :] = rv * np.sin(2 * np.pi * ph[i]) * np.cos(ang[i, :])
-        zv[i, :] = rv * np.sin(ang[i, :])
+    xv = rv[:, None, :] * np.cos(phv) * np.cos(ang)
+    yv = rv[:, None, :] * np.sin(phv) * np.cos(ang)
+    zv = np.broadcast_to(rv[:, None, :], ang.shape) * np.sin(ang)
 
     return ang, xv, yv, zv
 
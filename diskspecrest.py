@@ -1,7 +1,11 @@
 import numpy as np
 import os
-from dtmpspec import dtmpspec
-from diskshape import diskshape
+from dtmpspec import dtmpspec, dtmpspec_cells
+from diskgeometry import disk_geometry_from_params
+from diskchunk import ChunkedDisk, dtmpspec_chunked, load_dtemp, dtemp_field
+from skygrid import EqualAreaGrid
+from beam import beam_floor, beam_set_from_params, star_profile
+from beammap import BeamMap
 def diskspecrest(bdir):
     """
     Plot views of the heated accretion disk.
@@ -20,6 +24,14 @@ def diskspecrest(bdir):
     phsoff = params['phsoff']
 
     disk_parameters = [rin,rout,tiltin,tiltout,phsoff]
+
+    # The disk shape does not change with the beam rotation, so build it once
+    geometry = disk_geometry_from_params(params)
+
+    # Large grids are done in blocks, reading the memory-mapped dtemp_XXX/ directories
+    chunk = int(params['chunk']) if 'chunk' in params else 0
+    if chunk > 0:
+        chunked = ChunkedDisk(geometry, chunk)
     
     nangtoview = 2
     ang = np.arange(nangtoview) / nangtoview
@@ -46,13 +58,26 @@ def diskspecrest(bdir):
     thobsdiff = np.abs(thbeam - obselev)
     ithobs = np.argmin(thobsdiff)
 
+    # The saved illumination is a pixel map when the beam was computed on the equal-area sky grid
+    sky = str(params['sky']) if 'sky' in params else 'grid'
+    if sky == 'equalarea':
+        sky_pixels = EqualAreaGrid(int(params['nring']))
+
+    # The star's profile can be evaluated directly at the spin phases of the rotations instead of
+    # being looked up in the saved illumination
+    starprofile = str(params['starprofile']) if 'starprofile' in params else 'grid'
+    if starprofile == 'direct':
+        if 'beammap' in params and str(params['beammap']):
+            beam_source = BeamMap(str(params['beammap']))
+        else:
+            beam_source = beam_set_from_params(params)
+
     # Initialize Tmax and Tmin for colormap
     Tmax = 0.0
     Tmin = 1.0e20
 
     for k in range(nang):
-        dtemp_path = os.path.join(bdir, f'dtemp_{k:03d}.npz')
-        dtemp = np.load(dtemp_path)
+        dtemp = load_dtemp(bdir, k)
         for key in dtemp.keys():
             print(f"{key}: {dtemp[key]}")
         T = dtemp['T']
@@ -80,9 +105,12 @@ def diskspecrest(bdir):
 
         diskvf_path = os.path.join(diskphi_dir, 'diskvf.npz')
 
+        if starprofile == 'direct':
+            instar[:] = star_profile(beam_source, beam_floor(params), obselev, np.arange(nang) / nang,
+                                     obslong=2.0 * np.pi * angc[i] % (2.0 * np.pi), lum38=params['lum38'])
+
         for j in range(nang):
-            dtemp_path = os.path.join(bdir, f'dtemp_{j:03d}.npz')
-            dtemp = np.load(dtemp_path)
+            dtemp = load_dtemp(bdir, j)
             T = dtemp['T']
             illum = dtemp['illum']
             phbeam = dtemp['phbeam']
@@ -104,7 +132,13 @@ def diskspecrest(bdir):
                 beamoff = np.abs(phbeam - (2.0 * np.pi + 2.0 * np.pi * angc[i]))
 
             irot = np.argmin(beamoff)
-            instar[j] = 4.0 * np.pi * illum[ithobs, irot]
+
+            # The direct profile has already been evaluated for all the rotations
+            if starprofile != 'direct':
+                if sky == 'equalarea':
+                    instar[j] = 4.0 * np.pi * sky_pixels.lookup(illum, obselev, 2.0 * np.pi * angc[i])
+                else:
+                    instar[j] = 4.0 * np.pi * illum[ithobs, irot]
 
 
             # Check if the disk viewing information has already been saved
@@ -116,8 +150,22 @@ def diskspecrest(bdir):
                 diskv = 'n'
 
             # Calculate the observed view of the disk
-            ang, xv, yv, zv = diskshape(npoints, nprofs, disk_parameters)  # Assuming the diskshape function is defined
-            intot, intotx, en, spec = dtmpspec(xv, yv, zv, labs, T, Tmax, Tmin, side, ph, angc[i], obselev, fast, diskv, diskvf_path, plot)
+            if chunk > 0:
+                intot, intotx, en, spec = dtmpspec_chunked(chunked, labs, T, side, ph, angc[i], obselev, workdir=diskphi_dir)
+                inrep[j] = intot
+                inrepx[j] = intotx
+                np.savez(os.path.join(diskphi_dir, f'spec_{j:03d}.npz'), en=en, spec=spec)
+                continue
+
+            # Sparse profiles only hold the illuminated cells, which are all the spectrum needs
+            if 'index' in dtemp and plot != 'y' and fast != 'y':
+                intot, intotx, en, spec = dtmpspec_cells(geometry, dtemp['index'], labs, T, side, ph, angc[i], obselev,
+                                                         diskv, diskvf_path)
+            else:
+                labs, T, side = (dtemp_field(dtemp, key) for key in ('labs', 'T', 'side'))
+                xv, yv, zv = geometry.xv, geometry.yv, geometry.zv
+                intot, intotx, en, spec = dtmpspec(xv, yv, zv, labs, T, Tmax, Tmin, side, ph, angc[i], obselev, fast, diskv,
+                                                   diskvf_path, plot, geometry=geometry)
 
             # Get the pulse profile information
             inrep[j] = intot
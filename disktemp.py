@@ -1,5 +1,5 @@
 import numpy as np
-from diskshape import diskshape
+from diskgeometry import DiskGeometry, nearest_index, interpolation_stencil, interpolate_grid
 from ploting.plt_disk import plot_disk_with_illumination_surface
 
 """    
@@ -7,17 +7,8 @@ from ploting.plt_disk import plot_disk_with_illumination_surface
     k = 1.3807E-16  # Boltzmann constant in erg/K
 """
 
-def cross_product(v1, v2):
-    """Calculate the cross product of two vectors."""
-    return np.array([
-        v1[1] * v2[2] - v1[2] * v2[1],
-        v1[2] * v2[0] - v1[0] * v2[2],
-        v1[0] * v2[1] - v1[1] * v2[0]
-    ])
-
-
-
-def disktemp(npoints, nprof, rinphys, thbeam, phbeam, illum, ph, xv, yv, zv, T, side, lemit, disk_parameters):
+def disktemp(npoints, nprof, rinphys, thbeam, phbeam, illum, ph, xv, yv, zv, T, side, lemit, disk_parameters, geometry=None,
+             interpolation='nearest'):
     """
     Calculate the temperature of the disk given an input radiation field.
     
@@ -36,83 +27,191 @@ def disktemp(npoints, nprof, rinphys, thbeam, phbeam, illum, ph, xv, yv, zv, T,
     :param T: Temperature array
     :param side: Side illumination array
     :param lemit: Emitted luminosity
+    :param geometry: Optional DiskGeometry of this disk; reuses its cached side, sang, areas and beam index maps
+    :param interpolation: 'nearest' beam grid point, or 'bilinear' / 'bicubic' interpolation of the illumination
     """
 
+    if geometry is not None:
+        return disktemp_geometry(geometry, rinphys, thbeam, phbeam, illum, interpolation)
+
     # PHYSICAL CONSTANTS--------
     SBsigma = 5.6705E-5  # Stefan-Boltzmann constant in erg/(cm^2 K^4 s)
-    
-    # Arrays to store side illumination, temperature, solid angle, and energy absorbed
-    side = np.zeros((npoints, nprof), dtype=int)
-    sang = np.zeros((npoints, nprof))
-    labs = np.zeros((npoints, nprof))
 
-    # Calculate the shape of the disk
-    ang, xv, yv, zv = diskshape(npoints, nprof, disk_parameters)
+    # Shape of the disk, the illuminated side and the patch orientations, all computed array-wide
+    geometry = DiskGeometry(npoints, nprof, disk_parameters)
+    ang = geometry.ang
+    side = geometry.side.copy()
+    lit = side != 0
+    jlo, jhi, _, _ = geometry.neighbours
+
+    # Solid angle from the central source, with constant steps in the given phi angles
+    phistep = ph[1] - ph[0]
+    sang = np.abs((2 * np.pi * phistep) * (ang[:, jhi] - ang[:, jlo]) / 2 * np.cos(ang))
+
+    # Map disk points to the nearest cells of the illumination array, or interpolate between the cells
+    if callable(illum):
+        beam_illum_on_disk = illum(ang, 2 * np.pi * ph[:, None])
+    elif interpolation != 'nearest':
+        th_stencil = interpolation_stencil(ang, thbeam, interpolation)
+        phi_stencil = interpolation_stencil(2 * np.pi * ph[:, None], phbeam, interpolation, periodic=True)
+        beam_illum_on_disk = interpolate_grid(illum, th_stencil, phi_stencil)
+        if interpolation == 'bicubic':
+            # Catmull-Rom overshoots below zero next to steep drops of the illumination
+            beam_illum_on_disk = np.maximum(beam_illum_on_disk, 0.0)
+    else:
+        disk_illum_phi = nearest_index(2 * np.pi * ph, phbeam)[:, None]
+        disk_illum_th = nearest_index(ang, thbeam)
+        beam_illum_on_disk = illum[disk_illum_th, disk_illum_phi]
+
+    # Luminosity absorbed by the illuminated segments
+    labs = np.where(lit, beam_illum_on_disk * sang, 0.0)
+
+    # Calculate the temperature of the illuminated segments using the Stefan-Boltzmann law
+    area = rinphys**2 * geometry.area
+    T[lit] = (1E38)**(1/4) * (labs[lit] / (SBsigma * area[lit]))**(1/4)
 
-    # Assume constant steps in phi
-    phistep = np.full(npoints, ph[1] - ph[0])
+    # Calculate the emitted radiation
+    lemit = np.sum(labs[lit])
 
-    # Calculate illumination array elements corresponding to disk points
-    disk_illum_phi = np.zeros(npoints, dtype=int)
-    disk_illum_th = np.zeros((npoints, nprof), dtype=int)
-    beam_illum_on_disk = np.zeros((npoints, nprof))
+    return side, T, sang, labs, lemit
 
-    # Map disk points to illumination array indices
-    for i in range(npoints):
-        difphi = np.abs(2 * np.pi * ph[i] - phbeam)
-        disk_illum_phi[i] = np.argmin(difphi)
 
-        for j in range(nprof):
-            difth = np.abs(ang[i, j] - thbeam)
-            disk_illum_th[i, j] = np.argmin(difth)
-            beam_illum_on_disk[i, j] = illum[disk_illum_th[i, j], disk_illum_phi[i]]
+def disktemp_geometry(geometry, rinphys, thbeam, phbeam, illum, interpolation='nearest'):
+    """
+    Calculate the temperature of the disk from the cached quantities of a DiskGeometry.
 
-    # plot_disk_with_illumination_surface(xv, yv, zv, beam_illum_on_disk)
+    Only the beam lookup and the temperature depend on the illumination; everything else is
+    computed once per disk and reused for every beam rotation.
 
-    # Calculate the temperature profiles for each phi angle
-    for i in range(npoints):
-        p1 = ang[i, :]
+    :param geometry: DiskGeometry of the disk (or stack of disks)
+    :param rinphys: Inner physical radius, scalar or one value per disk
+    :param thbeam: Array of theta illumination of the beams
+    :param phbeam: Array of phi illumination of the beams
+    :param illum: Illumination array, (nth, nphi), or (nbatch, nth, nphi) for a stack of disks, or a
+                  function of (latitude, longitude) giving the illumination directly at the disk points
+                  (thbeam and phbeam are then not used)
+    :param interpolation: 'nearest' beam grid point, or 'bilinear' / 'bicubic' interpolation of the
+                          illumination (periodic in phi)
+    :return: side, T, sang, labs, lemit
+    """
 
-        angin = p1[0]
-        anghi = angin
-        anglo = angin
+    # PHYSICAL CONSTANTS--------
+    SBsigma = 5.6705E-5  # Stefan-Boltzmann constant in erg/(cm^2 K^4 s)
 
-        # Determine the bounds in phi of this particular piece of the disk
-        inds = [i-1, i+1] if i not in [0, npoints-1] else ([npoints-1, 1] if i == 0 else [npoints-2, 0])
+    side = geometry.side
+    sang = geometry.sang
+    lit = side != 0
+
+    # Look up the illumination of every disk point on the beam grid, or evaluate it at the disk directions
+    if callable(illum):
+        beam_illum_on_disk = illum(geometry.ang, 2 * np.pi * geometry.ph[:, None])
+    elif interpolation != 'nearest':
+        th_stencil, phi_stencil = geometry.illum_stencil(thbeam, phbeam, interpolation)
+        beam_illum_on_disk = interpolate_grid(illum, th_stencil, phi_stencil, batched=geometry.batched and illum.ndim == 3)
+        if interpolation == 'bicubic':
+            # Catmull-Rom overshoots below zero next to steep drops of the illumination
+            beam_illum_on_disk = np.maximum(beam_illum_on_disk, 0.0)
+    elif illum.ndim == 2:
+        disk_illum_th, disk_illum_phi = geometry.illum_index(thbeam, phbeam)
+        beam_illum_on_disk = illum[disk_illum_th, disk_illum_phi]
+    else:
+        disk_illum_th, disk_illum_phi = geometry.illum_index(thbeam, phbeam)
+        nbatch = illum.shape[0]
+        beam_illum_on_disk = illum[np.arange(nbatch)[:, None, None], disk_illum_th, disk_illum_phi]
+
+    # Luminosity absorbed by the illuminated segments
+    labs = np.where(lit, beam_illum_on_disk * sang, 0.0)
+
+    # Calculate the temperature of the illuminated segments using the Stefan-Boltzmann law
+    rinphys = np.asarray(rinphys, dtype=float)
+    if rinphys.ndim > 0:
+        rinphys = rinphys.reshape(-1, 1, 1)
+    area = np.broadcast_to(rinphys**2, side.shape) * geometry.area
+    T = np.zeros(side.shape)
+    T[lit] = (1E38)**(1/4) * (labs[lit] / (SBsigma * area[lit]))**(1/4)
 
-        for j in range(nprof):
-            # Determine the bounds in angle of this piece of the disk
-            jnds = [j-1, j+1] if j not in [0, nprof-1] else ([0, 1] if j == 0 else [nprof-2, nprof-1])
+    # Calculate the emitted radiation
+    lemit = np.sum(labs.reshape(-1, side.shape[-2] * side.shape[-1]), axis=1)
+    if not geometry.batched:
+        lemit = lemit[0]
 
-            # Determine if the disk is top-illuminated
-            if p1[j] > anghi:
-                anghi = p1[j]
-                side[i, j] = 1
+    return side, T, sang, labs, lemit
 
-            # Determine if the disk is bottom-illuminated
-            if ang[i, j] < anglo:
-                anglo = p1[j]
-                side[i, j] = -1
 
-            # Calculate the solid angle from the central source
-            sang[i, j] = np.abs((2 * np.pi * phistep[i]) * (ang[i, jnds[1]] - ang[i, jnds[0]]) / 2 * np.cos(ang[i, j]))
+def disktemp_rotations(geometry, rinphys, thbeam, phbeam, illum, interpolation='nearest'):
+    """
+    Calculate the temperature of one disk for a whole stack of illumination patterns (e.g. all the
+    rotations of the beams) in one gather over the illuminated points.
 
-            # Calculate the temperature if the disk segment is illuminated
-            if side[i, j] != 0:
-                labs[i, j] = beam_illum_on_disk[i, j] * sang[i, j]
+    Gives the same side, sang, labs, T and lemit as disktemp_geometry for every pattern in the stack.
 
-                # Calculate vectors for the area estimation
-                vec1 = np.array([xv[i, jnds[1]] - xv[i, jnds[0]], yv[i, jnds[1]] - yv[i, jnds[0]], zv[i, jnds[1]] - zv[i, jnds[0]]])
-                vec2 = np.array([xv[inds[1], j] - xv[inds[0], j], yv[inds[1], j] - yv[inds[0], j], zv[inds[1], j] - zv[inds[0], j]])
+    :param geometry: DiskGeometry of a single disk
+    :param rinphys: Inner physical radius
+    :param thbeam: Array of theta illumination of the beams
+    :param phbeam: Array of phi illumination of the beams
+    :param illum: Illumination arrays, (nang, nth, nphi)
+    :param interpolation: 'nearest' beam grid point, or 'bilinear' / 'bicubic' interpolation of the
+                          illumination (periodic in phi)
+    :return: side, sang (npoints, nprof), T, labs (nang, npoints, nprof) and lemitv (nang,)
+    """
 
-                # Calculate the cross product to estimate the area
-                orient = cross_product(vec1, vec2)
-                area = rinphys**2 * np.sqrt(np.sum(orient**2))
+    # PHYSICAL CONSTANTS--------
+    SBsigma = 5.6705E-5  # Stefan-Boltzmann constant in erg/(cm^2 K^4 s)
 
-                # Calculate the temperature using the Stefan-Boltzmann law
-                T[i, j] = (1E38)**(1/4) * (labs[i, j] / (SBsigma * area))**(1/4)
+    side = geometry.side
+    sang = geometry.sang
+    lit = side != 0
+    nang, nth, nphi = illum.shape
+
+    # Illumination of the illuminated points for all patterns at once, (nang, nlit)
+    if interpolation == 'nearest':
+        disk_illum_th, disk_illum_phi = geometry.illum_index(thbeam, phbeam)
+        flat_index = (disk_illum_th * nphi + disk_illum_phi)[lit]
+        beam_illum_on_disk = illum.reshape(nang, nth * nphi)[:, flat_index]
+    else:
+        th_stencil, phi_stencil = geometry.illum_stencil(thbeam, phbeam, interpolation)
+        phi_stencil = tuple(np.broadcast_to(v, th_stencil[0].shape[:-1] + v.shape[-1:]) for v in phi_stencil)
+        beam_illum_on_disk = interpolate_grid(illum, tuple(v[lit] for v in th_stencil),
+                                              tuple(v[lit] for v in phi_stencil))
+        if interpolation == 'bicubic':
+            # Catmull-Rom overshoots below zero next to steep drops of the illumination
+            beam_illum_on_disk = np.maximum(beam_illum_on_disk, 0.0)
+
+    # Luminosity absorbed and temperature of the illuminated segments
+    labs_lit = beam_illum_on_disk * sang[lit]
+    area = rinphys**2 * geometry.area[lit]
+    T_lit = (1E38)**(1/4) * (labs_lit / (SBsigma * area))**(1/4)
+
+    labs = np.zeros((nang,) + side.shape)
+    T = np.zeros((nang,) + side.shape)
+    labs[:, lit] = labs_lit
+    T[:, lit] = T_lit
 
     # Calculate the emitted radiation
-    lemit = np.sum(labs[side != 0])
+    lemitv = np.sum(labs.reshape(nang, -1), axis=1)
 
-    return side, T, sang, labs, lemit
+    return side, sang, T, labs, lemitv
+
+
+def disktemp_batch(npoints, nprof, rinphys, thbeam, phbeam, illum, disk_parameters_v, interpolation='nearest'):
+    """
+    Calculate the temperature of a stack of disks in one vectorized pass.
+
+    Gives the same side, T, sang and labs as disktemp for every disk in the stack, on the phases of
+    diskshape. This is for scanning many disks in memory; the runs written by input_parameters are
+    still done one directory at a time by disktempsave.
+
+    :param npoints: Number of points in the disk (number of points that constitute the ring)
+    :param nprof: Number of profile points (number of which build up the warped disk)
+    :param rinphys: Inner physical radius, scalar or one value per disk
+    :param thbeam: Array of theta illumination of the beams
+    :param phbeam: Array of phi illumination of the beams
+    :param illum: Illumination array, (nth, nphi) shared by all disks or (nbatch, nth, nphi)
+    :param disk_parameters_v: Array of shape (nbatch, 5), one [rin, rout, tiltin, tiltout, phsoff] per disk
+    :param interpolation: 'nearest' beam grid point, or 'bilinear' / 'bicubic' interpolation of the illumination
+    :return: side, T, sang, labs of shape (nbatch, npoints, nprof) and lemit of shape (nbatch,)
+    """
+
+    geometry = DiskGeometry(npoints, nprof, np.atleast_2d(disk_parameters_v))
+
+    return disktemp_geometry(geometry, rinphys, thbeam, phbeam, illum, interpolation)
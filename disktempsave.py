@@ -1,7 +1,14 @@
 import numpy as np
 import os
-from beam import beam_luminosity, Beam
-from disktemp import disktemp  # Import the disktemp function from the disktemp module
+import functools
+from beam import beam_floor, beam_luminosity, beam_luminosity_at, beam_luminosity_sparse, beam_luminosity_threaded, beam_basis, rotate_patterns, Beam, BeamSet
+from disktemp import disktemp, disktemp_rotations  # Import the disktemp function from the disktemp module
+from diskgeometry import disk_geometry_from_params
+from beamharmonic import BeamHarmonics
+from skygrid import EqualAreaGrid
+from beammap import BeamMap
+from diskchunk import ChunkedDisk, disktemp_chunked
+from diskirradiate import ViewFactorTree, reirradiate
 from ploting.plt_beam import plot_beam_3D
 import time
 
@@ -32,6 +39,28 @@ def disktempsave(bdir):
 
     disk_parameters = [rin,rout,tiltin,tiltout,phsoff]
 
+    # Everything about the disk that does not depend on the beam rotation is computed once here
+    geometry = disk_geometry_from_params(params_data)
+
+    # An adaptive mesh sets its own resolution and phases
+    npoints, nprofs, ph = geometry.npoints, geometry.nprof, geometry.ph
+
+    # Large grids are done in blocks, with the results in memory-mapped dtemp_XXX/ directories
+    chunk = int(params_data['chunk']) if 'chunk' in params_data else 0
+    if chunk > 0:
+        chunked = ChunkedDisk(geometry, chunk)
+
+    # The dtemp_XXX.npz files hold the full grids ('dense') or only the illuminated cells ('sparse')
+    storage = str(params_data['storage']) if 'storage' in params_data else 'dense'
+
+    # Optional re-irradiation of the disk by its own emission, with view factors summed over a tree
+    reirradiation = str(params_data['reirradiation']) if 'reirradiation' in params_data else 'none'
+    if reirradiation == 'tree':
+        if chunk > 0:
+            raise ValueError("Re-irradiation is not available in chunked mode")
+        reirrtheta = float(params_data['reirrtheta']) if 'reirrtheta' in params_data else 0.2
+        view_factors = ViewFactorTree(geometry, reirrtheta)
+
     # Extract multiple beam parameters
     beams = []
     for key in params_data:
@@ -46,9 +75,19 @@ def disktempsave(bdir):
 
     # Convert beam dictionaries to Beam objects
     beam_objects = [Beam(**beam) for beam in beams]
+    beam_set = BeamSet.from_beams(beam_objects)
+
+    # A tabulated beam map (a memory-mapped .npy file) replaces the Gaussian beams and their floor
+    beam_map = None
+    if 'beammap' in params_data and str(params_data['beammap']):
+        beam_map = BeamMap(str(params_data['beammap']))
 
     # Generate the beam shape using the provided parameters
-    thbeam, phbeam, nlum = beam_luminosity(nth_beam, nphi_beam, beam_objects, 0, 0)
+    if beam_map is not None:
+        thbeam, phbeam, nlum = beam_map.luminosity(nth_beam, nphi_beam)
+        nlum = nlum[0]
+    else:
+        thbeam, phbeam, nlum = beam_luminosity(nth_beam, nphi_beam, beam_objects, 0, 0)
 
     print("Saving beam parameters to diskbeam.npz...")
     # Save the beam parameters and generated beam shape to a file
@@ -62,17 +101,115 @@ def disktempsave(bdir):
     print("Calculating disk temperature profiles for each angle...")
     # Calculate the step size for angles
     angle_step = 2 * np.pi / nang
+    rotation_angles = np.arange(nang) * angle_step
+
+    # Minimum of the Gaussian beam patterns
+    floor = beam_floor(params_data)
+
+    # Narrow beams can be evaluated only within nsigma of their cones
+    nsigma = float(params_data['nsigma']) if 'nsigma' in params_data else 0.0
+
+    # Rotations can also be spread over a pool of threads
+    threads = int(params_data['threads']) if 'threads' in params_data else 0
+
+    def evaluate_patterns(angles):
+        if nsigma > 0:
+            return beam_luminosity_sparse(nth_beam, nphi_beam, beam_set, floor, angles, nsigma)[2]
+        if threads > 0:
+            return beam_luminosity_threaded(nth_beam, nphi_beam, beam_set, floor, angles, workers=threads)[2]
+        # Unit patterns are cached across runs, so runs that only change the norms reuse them
+        return beam_basis.luminosity(nth_beam, nphi_beam, beam_set, floor, angles)[2]
+
+    # Beam patterns are either evaluated for every rotation or shifted from the unrotated pattern
+    rotation = str(params_data['rotation']) if 'rotation' in params_data else 'evaluate'
+    if rotation == 'shift':
+        nlum_base = evaluate_patterns(rotation_angles[:1])[0]
+
+    # A spherical-harmonic pattern is rotated exactly by phase factors
+    pattern = str(params_data['pattern']) if 'pattern' in params_data else 'grid'
+    if pattern == 'harmonic':
+        lmax = int(params_data['lmax']) if 'lmax' in params_data else 0
+        harmonics = BeamHarmonics.from_beams(beam_set, floor, lmax if lmax > 0 else None)
+
+    # Patterns on an equal-area sky grid with its own resolution instead of the nth x nphi grid
+    sky = str(params_data['sky']) if 'sky' in params_data else 'grid'
+    if sky == 'equalarea':
+        sky_pixels = EqualAreaGrid(int(params_data['nring']))
+        # The equal-area patterns are always evaluated directly on the pixels
+        if pattern == 'harmonic' or rotation == 'shift' or nsigma > 0:
+            raise ValueError("sky='equalarea' cannot be combined with pattern='harmonic', rotation='shift' or nsigma > 0")
+
+    # A beam map is always interpolated from the map itself
+    if beam_map is not None and (pattern == 'harmonic' or rotation == 'shift' or nsigma > 0):
+        raise ValueError("A beammap cannot be combined with pattern='harmonic', rotation='shift' or nsigma > 0")
+
+    def rotated_patterns(angles):
+        if beam_map is not None:
+            if sky == 'equalarea':
+                return sky_pixels.normalize(beam_map.pattern_at(sky_pixels.lat, sky_pixels.lon, angles))
+            return beam_map.luminosity(nth_beam, nphi_beam, angles)[2]
+        if sky == 'equalarea':
+            return sky_pixels.luminosity(beam_set, floor, angles)
+        if pattern == 'harmonic':
+            return harmonics.luminosity(thbeam, phbeam, angles)
+        if rotation == 'shift':
+            return rotate_patterns(thbeam, phbeam, nlum_base, angles)
+        return evaluate_patterns(angles)
+
+    # The disk is heated by the pattern looked up on the beam 'grid', or evaluated 'direct'ly at the
+    # directions of the disk points (the grid pattern is still saved for the observer's view of the star)
+    illumination = str(params_data['illumination']) if 'illumination' in params_data else 'grid'
+
+    # Illumination of the disk points taken from the 'nearest' beam grid point, or interpolated
+    # 'bilinear'ly or 'bicubic'ally between the grid points
+    interpolation = str(params_data['interpolation']) if 'interpolation' in params_data else 'nearest'
+    # Pixel lookups and direct evaluations do not go through the beam grid
+    if interpolation != 'nearest' and (sky == 'equalarea' or illumination == 'direct'):
+        raise ValueError(f"interpolation='{interpolation}' cannot be combined with sky='equalarea' or illumination='direct'")
+
+    def direct_illum(star_rot_ang, lat, lon):
+        if beam_map is not None:
+            return lum38 * beam_map.luminosity_at(lat, lon, [star_rot_ang])[0]
+        return lum38 * beam_luminosity_at(lat, lon, beam_set, floor, [star_rot_ang])[0]
+
+    # Beam patterns for all rotations at once; in chunked mode the disk grids are large, so the
+    # patterns are generated one rotation at a time instead of holding the full stack
+    if chunk == 0:
+        nlum_all = rotated_patterns(rotation_angles)
+
+    # With the illumination taken from the beam grid, the disk is heated by all the rotations in one pass
+    stacked = chunk == 0 and sky == 'grid' and illumination == 'grid'
+    if stacked:
+        _, _, T_all, labs_all, lemitv_all = disktemp_rotations(geometry, rinphys, thbeam, phbeam, nlum_all * lum38,
+                                                               interpolation)
 
     # Loop over each angle
     for ang in range(nang):
         print(f"Processing angle {ang + 1} of {nang}...")
-        rotation_angle = ang * angle_step
-        
-        # Generate the beam shape with the correct rotation angle
-        thbeam, phbeam, nlum_rotated = beam_luminosity(nth_beam, nphi_beam, beam_objects, 0.1, rotation_angle)
+
+        # Beam shape with the correct rotation angle
+        if chunk == 0:
+            nlum_rotated = nlum_all[ang]
+        else:
+            nlum_rotated = rotated_patterns(rotation_angles[ang:ang + 1])[0]
 
         # Calculate the illumination based on the rotated beam
         illum = nlum_rotated * lum38
+        disk_illum = illum
+        if sky == 'equalarea':
+            disk_illum = functools.partial(sky_pixels.lookup, illum)
+        if illumination == 'direct':
+            disk_illum = functools.partial(direct_illum, rotation_angles[ang])
+
+        if chunk > 0:
+            print(f"Saving disk temperature profile to dtemp_{ang:03d}/...")
+            dtemp_dir = os.path.join(bdir, f'dtemp_{ang:03d}')
+            _, _, _, _, lemit = disktemp_chunked(chunked, rinphys, thbeam, phbeam, disk_illum, workdir=dtemp_dir,
+                                                 interpolation=interpolation)
+            for key, value in (('ph', ph), ('illum', illum), ('phbeam', phbeam)):
+                np.save(os.path.join(dtemp_dir, f'{key}.npy'), value)
+            lemitv[ang] = lemit
+            continue
 
         # Create a disk and heat it with an isotropic X-ray source
         xv = np.zeros((npoints, nprofs))
@@ -83,13 +220,23 @@ def disktempsave(bdir):
         lemit = 0.0
         
         # Calculate the disk temperature and other properties
-        side, T, _, labs, lemit = disktemp(params_data['npoints'], params_data['nprof'], rinphys, thbeam, phbeam, illum, 
-                ph, xv, yv, zv, T, side, lemit, disk_parameters)
+        if stacked:
+            side, T, labs, lemit = geometry.side, T_all[ang], labs_all[ang], lemitv_all[ang]
+        else:
+            side, T, _, labs, lemit = disktemp(npoints, nprofs, rinphys, thbeam, phbeam, disk_illum,
+                    ph, xv, yv, zv, T, side, lemit, disk_parameters, geometry=geometry, interpolation=interpolation)
+        if reirradiation == 'tree':
+            T, labs, lemit = reirradiate(view_factors, rinphys, labs)
         
         print(f"Saving disk temperature profile to dtemp_{ang:03d}.npz...")
         # Save the disk temperature profile and other properties to a file
         dtemp_path = os.path.join(bdir, f'dtemp_{ang:03d}.npz')
-        np.savez(dtemp_path, ph=params_data['ph'], illum=illum, xv=xv, yv=yv, zv=zv, labs=labs, T=T, side=side, phbeam=phbeam)
+        if storage == 'sparse':
+            index = np.flatnonzero(side)
+            np.savez(dtemp_path, ph=ph, illum=illum, phbeam=phbeam, shape=np.array(side.shape), index=index,
+                     labs=labs.ravel()[index], T=T.ravel()[index], side=side.ravel()[index])
+        else:
+            np.savez(dtemp_path, ph=ph, illum=illum, xv=xv, yv=yv, zv=zv, labs=labs, T=T, side=side, phbeam=phbeam)
         
         # Store the emitted luminosity for the current angle in the lemitv array
         lemitv[ang] = lemit
@@ -16,10 +16,13 @@ def cross_product(v1, v2):
     ])
 
 
-def dtmpspec(xv, yv, zv, labs, T, Tmax, Tmin, side, ph, phio, obselev, fast, diskv, diskvf, plot):
+def dtmpspec(xv, yv, zv, labs, T, Tmax, Tmin, side, ph, phio, obselev, fast, diskv, diskvf, plot, geometry=None):
     """
     Take a disk with a given temperature profile and calculate the emission seen by the observer.
     RCH 7/04
+
+    If a DiskGeometry is given, the rotated coordinates and the visibility of the disk are taken
+    from its cache instead of being recomputed for every beam rotation.
     """
 
     # This is the new phi array, rotated by phio
@@ -49,15 +52,18 @@ def dtmpspec(xv, yv, zv, labs, T, Tmax, Tmin, side, ph, phio, obselev, fast, dis
     Tclrmax = 255.0
     clrdisk = 'k'
 
-    for i in range(nang):
-        # Rotate with respect to phi
-        xvf[i, :] = xv[i, :] * np.cos(2.0 * np.pi * phf[i]) / np.cos(2.0 * np.pi * ph[i])
-        yvf[i, :] = yv[i, :] * np.sin(2.0 * np.pi * phf[i]) / np.sin(2.0 * np.pi * ph[i])
+    if geometry is not None:
+        xv2, yv2, zv2 = geometry.observer_frame(ph, phio, obselev)
+    else:
+        for i in range(nang):
+            # Rotate with respect to phi
+            xvf[i, :] = xv[i, :] * np.cos(2.0 * np.pi * phf[i]) / np.cos(2.0 * np.pi * ph[i])
+            yvf[i, :] = yv[i, :] * np.sin(2.0 * np.pi * phf[i]) / np.sin(2.0 * np.pi * ph[i])
 
-        # Change the elevation angle
-        xv2[i, :] = xvf[i, :] * np.cos(-obselev) - zv[i, :] * np.sin(-obselev)
-        yv2 = yvf
-        zv2[i, :] = zv[i, :] * np.cos(-obselev) + xvf[i, :] * np.sin(-obselev)
+            # Change the elevation angle
+            xv2[i, :] = xvf[i, :] * np.cos(-obselev) - zv[i, :] * np.sin(-obselev)
+            yv2 = yvf
+            zv2[i, :] = zv[i, :] * np.cos(-obselev) + xvf[i, :] * np.sin(-obselev)
 
     xin = xv2[:, 0]
     xout = xv2[:, -1]
@@ -79,7 +85,16 @@ def dtmpspec(xv, yv, zv, labs, T, Tmax, Tmin, side, ph, phio, obselev, fast, dis
     cmap = plt.get_cmap('viridis')  
 
 
-    if diskv == 'y':
+    if geometry is not None:
+        top, fsee, iplot = geometry.visibility(ph, phio, obselev)
+
+        # The per-pixel loop below only keeps the fsee of the last pixel
+        fsee = fsee[-1, -1]
+        see = top * side
+
+        if diskv == 'y':
+            np.savez(diskvf, iplot=iplot, see=see, fsee=fsee)
+    elif diskv == 'y':
         top = np.zeros((nang, nprof), dtype=int)
 
         for i in range(nang):
@@ -227,4 +242,58 @@ def dtmpspec(xv, yv, zv, labs, T, Tmax, Tmin, side, ph, phio, obselev, fast, dis
         plt.show()
         plt.close()
 
-    return intot, intotx, en, spec
\ No newline at end of file
+    return intot, intotx, en, spec
+
+def dtmpspec_cells(geometry, index, labs, T, side, ph, phio, obselev, diskv, diskvf):
+    """
+    Emission seen by the observer from the illuminated cells only. Same intot, intotx, en and spec as
+    the slow (fast='n') path of dtmpspec with a DiskGeometry, without the plots.
+
+    :param geometry: DiskGeometry of the disk
+    :param index: Flat indices of the illuminated cells into the (npoints, nprof) grid
+    :param labs, T, side: Absorbed luminosity, temperature and illuminated side of these cells
+    :param ph: Phi angles the disk was saved with
+    :param phio: Phase rotation of the disk
+    :param obselev: Observer elevation angle
+    :param diskv: 'y' to save the visibility to diskvf, as dtmpspec
+    :param diskvf: Path of the visibility file
+    :return: intot, intotx, en, spec
+    """
+    top, fsee, iplot = geometry.visibility(ph, phio, obselev)
+
+    # The per-pixel loop of dtmpspec only keeps the fsee of the last pixel
+    fsee = fsee[-1, -1]
+
+    if diskv == 'y':
+        see = np.zeros(top.shape, dtype=top.dtype)
+        see.flat[index] = top.flat[index] * side
+        np.savez(diskvf, iplot=iplot, see=see, fsee=fsee)
+
+    # Cells we can see, with their illuminated side facing us
+    seen = iplot.flat[index] + top.flat[index] * side == 2
+    intens = fsee * labs[seen]
+    intot = np.sum(intens)
+
+    # Array to hold the energy and spectral info, as in dtmpspec
+    enbins = 1000
+    emin = 0.001
+    emax = 100.0
+    keV = 1.6021E-9
+    en = np.logspace(np.log10(emin), np.log10(emax), enbins)
+    energ = en * keV
+    spec = np.zeros(enbins)
+    T_seen = T[seen]
+    for start in range(0, len(intens), 4096):
+        sl = slice(start, start + 4096)
+        spec += intens[sl] @ bbnorm_v(T_seen[sl], energ)
+
+    xlo = 0.3
+    xhi = 0.7
+    endiff = np.diff(en)
+    spectot = np.sum(spec[:-1] * endiff)
+    ix = np.where((en >= xlo) & (en < xhi))[0]
+    specx = np.sum(spec[ix] * endiff[ix])
+
+    intotx = intot * specx / spectot
+
+    return intot, intotx, en, spec
@@ -1,15 +1,17 @@
 import os
 import glob
 import subprocess
+import numpy as np
 from disktempsave import disktempsave  # assuming disktempsave.py is the Python translation of the IDL disktempsave
 from diskspecrest import diskspecrest  # assuming diskspecrest.py is the Python translation of the IDL diskspecrest
 from fitplotprof import fitplotprof  # assuming fitplotprof.py is the Python translation of the IDL fitplotprof
 from fitplotprof_new import fitplotprof_new
+from diskrescale import rescale_run
 
 def fit_run(topdir):
     """Create input files and process a set of simulated profiles for various configurations."""
     # List all directories that include 'obs' in their names
-    dlist = [d for d in glob.glob(f"{topdir}/*obs*")]
+    dlist = sorted(glob.glob(f"{topdir}/*obs*"))
 
     
     for i, directory in enumerate(dlist):
@@ -19,11 +21,17 @@ def fit_run(topdir):
         
         print(f"Processing directory: {directory}")
 
-        # Make the disk temperature files
-        disktempsave(directory)
+        # Runs of a luminosity or radius sweep are rescaled from their reference run once it is done
+        params = np.load(os.path.join(directory, 'par.npz'))
+        reference = str(params['reference']) if 'reference' in params else ''
+        if reference and glob.glob(os.path.join(reference, 'diskphi_*', 'inprof.npz')):
+            rescale_run(reference, directory)
+        else:
+            # Make the disk temperature files
+            disktempsave(directory)
 
-        # Plot and get the profiles
-        diskspecrest(directory)
+            # Plot and get the profiles
+            diskspecrest(directory)
 
         # Remove the disk temperature files
         temp_files = glob.glob(f'{directory}/dtemp*.idl')
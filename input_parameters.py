@@ -1,4 +1,5 @@
 import os
+import itertools
 import numpy as np
 
 def input_parameters(topdir='./test/'):
@@ -15,6 +16,12 @@ def input_parameters(topdir='./test/'):
     tiltoutdeg = [30.0]
     phsoffvdeg = [139.0]
 
+    # Warp profile between rin and rout (see warpmodel.py): 'linear', 'powerlaw', 'tanh' or 'tabulated'
+    # Extra parameters of the model, e.g. {'tiltindex': 2.0} for 'powerlaw', {'rmid': 0.9, 'width': 0.02}
+    # for 'tanh' or {'table': 'warp.npz'} (with r, tilt, twist arrays) for 'tabulated'
+    warp = 'linear'
+    warp_params = {}
+
     # Observation properties
     obselevdeg = [-5.0]
 
@@ -43,8 +50,8 @@ def input_parameters(topdir='./test/'):
     phsoffv = np.radians(phsoffvdeg)
     obselevv = np.radians(obselevdeg)
 
-    # More beam properties
-    floor = 1.0
+    # More beam properties: floor added to the Gaussian beams before they are normalized
+    floor = 0.1
 
     # Disk angles
     npoints = 100
@@ -52,6 +59,41 @@ def input_parameters(topdir='./test/'):
     nth = npoints
     nphi = npoints
 
+    # Disk mesh: 'uniform' npoints x nprof grid, or 'adaptive' to refine where the edge of the lit side makes
+    # the absorbed luminosity hardest to integrate (npoints and nprof are then the largest resolution
+    # allowed, meshtol the target relative error of the absorbed luminosity)
+    mesh = 'uniform'
+    meshtol = 3e-2
+
+    # Patch normals, areas and solid angles: 'difference' of neighbouring grid points, or 'analytic' from the warp
+    normals = 'difference'
+
+    # Integration over the disk: 'midpoint' (one cell per point), or the alternative 'simpson' or 'gauss'
+    # weights in radius and phase (these use the analytic normals; 'gauss' places its own radial nodes)
+    quadrature = 'midpoint'
+
+    # Shadowing of the disk from the source: running max/min along every 'profile', or an angular
+    # 'horizon' buffer resampled at shadowsample azimuths per cell, which also finds partly lit cells
+    # (not available in chunked mode)
+    shadow = 'profile'
+    shadowsample = 4
+
+    # Re-irradiation of the disk by its own emission: 'none', or iterated to convergence with view
+    # factors summed over a 'tree' of the cells (groups smaller than reirrtheta times their distance
+    # are summed through their moments; not available in chunked mode). 'tree' ignores occlusion, so
+    # cells see each other through the disk and it overestimates the re-irradiation (labs, T and
+    # lemit) on warped disks
+    reirradiation = 'none'
+    reirrtheta = 0.2
+
+    # Block size for very large grids (0 keeps the whole disk in memory); the per-rotation results
+    # are then memory-mapped .npy files in dtemp_XXX/ directories
+    chunk = 0
+
+    # Per-rotation dtemp_XXX.npz files with the full 'dense' grids, or 'sparse' with only the
+    # illuminated cells (where T and labs are non-zero)
+    storage = 'dense'
+
     # Disk viewing angles
     nangtoview = 2
 
@@ -60,8 +102,49 @@ def input_parameters(topdir='./test/'):
     istep = nphi / nang
     iang = np.fix(np.arange(nang) * istep).astype(int)
 
-    rinphys = 1e8  # The location of the magnetosphere is around 10^8 cm
-    lum38 = 3.0  # The total hard emission luminosity in 10^38 ergs s^{-1}
+    # Beam patterns of the rotated star: 'evaluate' every rotation, or 'shift' the unrotated pattern
+    # along phi (exact when nang divides nphi - 1, a Fourier shift otherwise)
+    rotation = 'evaluate'
+
+    # Beam pattern sampled on the 'grid', or expanded in spherical 'harmonic's up to degree lmax
+    # (0 picks lmax from the narrowest beam) and normalized by its exact integral
+    pattern = 'grid'
+    lmax = 0
+
+    # Evaluate every beam only within nsigma standard deviations of its cone (0 evaluates the whole sky)
+    nsigma = 0
+
+    # Threads used to evaluate the beam patterns of the rotations (0 evaluates them in one call)
+    threads = 0
+
+    # Disk heating by the pattern on the beam 'grid' (nearest point), or evaluated 'direct'ly at the
+    # directions of the disk points and normalized over the whole sphere
+    illumination = 'grid'
+
+    # Illumination of the disk points from the 'nearest' point of the beam grid, or interpolated
+    # 'bilinear'ly or 'bicubic'ally (periodic in phi), which converges on coarser beam grids (only with
+    # sky='grid' and illumination='grid')
+    interpolation = 'nearest'
+
+    # Sky grid of the beam patterns: the equiangular nth x nphi 'grid', or an 'equalarea' grid of
+    # nring rings of equal-area pixels (about 4 nring^2 / pi pixels; evaluated directly, so not with
+    # pattern='harmonic', rotation='shift' or nsigma)
+    sky = 'grid'
+    nring = 64
+
+    # Tabulated beam map (.npy file of shape (nlat, nlon), read memory-mapped) used instead of the
+    # Gaussian beams below (not with pattern='harmonic', rotation='shift' or nsigma); '' uses the
+    # Gaussian beams
+    beammap = ''
+
+    # Star's pulse profile in diskspecrest: looked up on the saved beam 'grid', or evaluated 'direct'ly
+    # from the beams at the spin phases
+    starprofile = 'grid'
+
+    rinphysv = [1e8]  # The location of the magnetosphere is around 10^8 cm
+    lum38v = [3.0]  # The total hard emission luminosity in 10^38 ergs s^{-1}
+    # T scales as (lum38 / rinphys^2)^(1/4) and the luminosities as lum38, so only the first (lum38,
+    # rinphys) of every disk and beam is computed; the others are rescaled from it (see diskrescale)
     icnt = 0
 
     # Appropriate values of phase to use
@@ -91,55 +174,98 @@ def input_parameters(topdir='./test/'):
                         else:
                             strphs = f'tw{int(phsoffvdeg[i]):03d}'
 
-                        dirname = f"{topdir}{icnt:03d}{strobs}{strtin}{strtout}{strphs}{strth}"
-                        os.makedirs(dirname, exist_ok=True)
-
-                        # Write parameters to a file
-                        with open(f"{dirname}/par.dat", 'w') as f:
-                            f.write(f'INPUT to warp disk shape: {dirname}\n')
-                            f.write(f'#UTC: {np.datetime64("now")}\n\n')
-                            f.write('DISK PARAMETERS:\n')
-                            f.write(f'rin={rin}\n')
-                            f.write(f'rout={rout}\n')
-                            f.write(f'tiltin={tiltin}\n')
-                            f.write(f'tiltout={tiltout}\n')
-                            f.write(f'phsoff={phsoffv[i]}\n')
-                            f.write(f'npoints={npoints}\n')
-                            f.write(f'nprof={nprof}\n')
-                            f.write(f'nth={nth}\n')
-                            f.write(f'nphi={nphi}\n')
-                            f.write(f'ph={ph}\n\n')
-                            f.write('BEAM PARAMETERS:\n')
-                            f.write(f'nang={nang}\n')
+                        # Luminosity and physical radius sweeps, rescaled from the first run of the sweep
+                        reference = ''
+                        for lum38, rinphys in itertools.product(lum38v, rinphysv):
+                            strlum = ''
+                            if len(lum38v) * len(rinphysv) > 1:
+                                strlum = f'l{lum38:g}r{rinphys:g}'.replace('+', '')
+                            dirname = f"{topdir}{icnt:03d}{strobs}{strtin}{strtout}{strphs}{strth}{strlum}"
+                            os.makedirs(dirname, exist_ok=True)
+
+                            # Write parameters to a file
+                            with open(f"{dirname}/par.dat", 'w') as f:
+                                f.write(f'INPUT to warp disk shape: {dirname}\n')
+                                f.write(f'#UTC: {np.datetime64("now")}\n\n')
+                                f.write('DISK PARAMETERS:\n')
+                                f.write(f'rin={rin}\n')
+                                f.write(f'rout={rout}\n')
+                                f.write(f'tiltin={tiltin}\n')
+                                f.write(f'tiltout={tiltout}\n')
+                                f.write(f'phsoff={phsoffv[i]}\n')
+                                f.write(f'warp={warp}\n')
+                                for key, value in warp_params.items():
+                                    f.write(f'warp_{key}={value}\n')
+                                f.write(f'npoints={npoints}\n')
+                                f.write(f'nprof={nprof}\n')
+                                f.write(f'nth={nth}\n')
+                                f.write(f'nphi={nphi}\n')
+                                f.write(f'mesh={mesh}\n')
+                                f.write(f'meshtol={meshtol}\n')
+                                f.write(f'normals={normals}\n')
+                                f.write(f'quadrature={quadrature}\n')
+                                f.write(f'shadow={shadow}\n')
+                                f.write(f'shadowsample={shadowsample}\n')
+                                f.write(f'reirradiation={reirradiation}\n')
+                                f.write(f'reirrtheta={reirrtheta}\n')
+                                f.write(f'chunk={chunk}\n')
+                                f.write(f'storage={storage}\n')
+                                f.write(f'ph={ph}\n\n')
+                                f.write('BEAM PARAMETERS:\n')
+                                f.write(f'nang={nang}\n')
+                                f.write(f'rotation={rotation}\n')
+                                f.write(f'pattern={pattern}\n')
+                                f.write(f'lmax={lmax}\n')
+                                f.write(f'nsigma={nsigma}\n')
+                                f.write(f'threads={threads}\n')
+                                f.write(f'illumination={illumination}\n')
+                                f.write(f'interpolation={interpolation}\n')
+                                f.write(f'sky={sky}\n')
+                                f.write(f'nring={nring}\n')
+                                f.write(f'beammap={beammap}\n')
+                                f.write(f'starprofile={starprofile}\n')
+                                for bidx, beam in enumerate(beam_params):
+                                    f.write(f'beam_{bidx+1}_long={beam["long"]}\n')
+                                    f.write(f'beam_{bidx+1}_lat={beam["lat"]}\n')
+                                    f.write(f'beam_{bidx+1}_sigma={beam["sigma"]}\n')
+                                    f.write(f'beam_{bidx+1}_th={beam["th"]}\n')
+                                    f.write(f'beam_{bidx+1}_norm={beam["norm"]}\n')
+                                f.write(f'floor={floor}\n')
+                                f.write(f'rinphys={rinphys}\n')
+                                f.write(f'lum38={lum38}\n')
+                                f.write(f'reference={reference}\n')
+                                f.write(f'obselev={obselev}\n')
+                                f.write(f'nangtoview={nangtoview}\n')  # Add this line to the .dat file
+
+                            # Save parameters using numpy
+                            params = {
+                                'rin': rin, 'rout': rout, 'tiltin': tiltin, 'tiltout': tiltout, 'phsoff': phsoff,
+                                'npoints': npoints, 'nprof': nprof, 'nth': nth, 'nphi': nphi, 'nang': nang,
+                                'floor': floor, 'rinphys': rinphys, 'lum38': lum38, 'obselev': obselev, 'ph': ph,
+                                'nangtoview': nangtoview,  # Add this line to the .npz file
+                                'mesh': mesh, 'meshtol': meshtol, 'normals': normals, 'warp': warp,
+                                'quadrature': quadrature, 'shadow': shadow, 'shadowsample': shadowsample,
+                                'reirradiation': reirradiation, 'reirrtheta': reirrtheta,
+                                'chunk': chunk, 'storage': storage, 'rotation': rotation,
+                                'pattern': pattern, 'lmax': lmax, 'nsigma': nsigma, 'threads': threads,
+                                'illumination': illumination, 'interpolation': interpolation, 'sky': sky,
+                                'nring': nring, 'beammap': beammap, 'starprofile': starprofile,
+                                'reference': reference
+                            }
+                            for key, value in warp_params.items():
+                                params[f'warp_{key}'] = value
                             for bidx, beam in enumerate(beam_params):
-                                f.write(f'beam_{bidx+1}_long={beam["long"]}\n')
-                                f.write(f'beam_{bidx+1}_lat={beam["lat"]}\n')
-                                f.write(f'beam_{bidx+1}_sigma={beam["sigma"]}\n')
-                                f.write(f'beam_{bidx+1}_th={beam["th"]}\n')
-                                f.write(f'beam_{bidx+1}_norm={beam["norm"]}\n')
-                            f.write(f'floor={floor}\n')
-                            f.write(f'rinphys={rinphys}\n')
-                            f.write(f'lum38={lum38}\n')
-                            f.write(f'obselev={obselev}\n')
-                            f.write(f'nangtoview={nangtoview}\n')  # Add this line to the .dat file
-
-                        # Save parameters using numpy
-                        params = {
-                            'rin': rin, 'rout': rout, 'tiltin': tiltin, 'tiltout': tiltout, 'phsoff': phsoff,
-                            'npoints': npoints, 'nprof': nprof, 'nth': nth, 'nphi': nphi, 'nang': nang,
-                            'floor': floor, 'rinphys': rinphys, 'lum38': lum38, 'obselev': obselev, 'ph': ph,
-                            'nangtoview': nangtoview  # Add this line to the .npz file
-                        }
-                        for bidx, beam in enumerate(beam_params):
-                            params[f'beam_{bidx+1}_long'] = beam['long']
-                            params[f'beam_{bidx+1}_lat'] = beam['lat']
-                            params[f'beam_{bidx+1}_sigma'] = beam['sigma']
-                            params[f'beam_{bidx+1}_th'] = beam['th']
-                            params[f'beam_{bidx+1}_norm'] = beam['norm']
-
-                        np.savez(f"{dirname}/par.npz", **params)
-
-                        icnt += 1
+                                params[f'beam_{bidx+1}_long'] = beam['long']
+                                params[f'beam_{bidx+1}_lat'] = beam['lat']
+                                params[f'beam_{bidx+1}_sigma'] = beam['sigma']
+                                params[f'beam_{bidx+1}_th'] = beam['th']
+                                params[f'beam_{bidx+1}_norm'] = beam['norm']
+
+                            np.savez(f"{dirname}/par.npz", **params)
+
+                            icnt += 1
+                            if not reference:
+                                reference = dirname
 
     # Write parameters for all runs to a file
     with open(f"{topdir}/par.dat", 'w') as f:
@@ -151,14 +277,38 @@ def input_parameters(topdir='./test/'):
         f.write(f'tiltin={tiltindeg}\n')
         f.write(f'tiltout={tiltoutdeg}\n')
         f.write(f'phsoff={phsoffvdeg}\n')
+        f.write(f'warp={warp}\n')
+        for key, value in warp_params.items():
+            f.write(f'warp_{key}={value}\n')
         f.write(f'npoints={npoints}\n')
         f.write(f'nprof={nprof}\n')
         f.write(f'nth={nth}\n')
         f.write(f'nphi={nphi}\n')
+        f.write(f'mesh={mesh}\n')
+        f.write(f'meshtol={meshtol}\n')
+        f.write(f'normals={normals}\n')
+        f.write(f'quadrature={quadrature}\n')
+        f.write(f'shadow={shadow}\n')
+        f.write(f'shadowsample={shadowsample}\n')
+        f.write(f'reirradiation={reirradiation}\n')
+        f.write(f'reirrtheta={reirrtheta}\n')
+        f.write(f'chunk={chunk}\n')
+        f.write(f'storage={storage}\n')
         f.write(f'ph={ph}\n\n')
         f.write(f'obselev={obselevdeg}\n')
         f.write('BEAM PARAMETERS:\n')
         f.write(f'nang={nang}\n')
+        f.write(f'rotation={rotation}\n')
+        f.write(f'pattern={pattern}\n')
+        f.write(f'lmax={lmax}\n')
+        f.write(f'nsigma={nsigma}\n')
+        f.write(f'threads={threads}\n')
+        f.write(f'illumination={illumination}\n')
+        f.write(f'interpolation={interpolation}\n')
+        f.write(f'sky={sky}\n')
+        f.write(f'nring={nring}\n')
+        f.write(f'beammap={beammap}\n')
+        f.write(f'starprofile={starprofile}\n')
         for bidx, beam in enumerate(beam_params):
             f.write(f'beam_{bidx+1}_long={beam["long"]}\n')
             f.write(f'beam_{bidx+1}_lat={beam["lat"]}\n')
@@ -166,6 +316,6 @@ def input_parameters(topdir='./test/'):
             f.write(f'beam_{bidx+1}_th={beam["th"]}\n')
             f.write(f'beam_{bidx+1}_norm={beam["norm"]}\n')
         f.write(f'floor={floor}\n')
-        f.write(f'rinphys={rinphys}\n')
-        f.write(f'lum38={lum38}\n')
+        f.write(f'rinphys={rinphysv}\n')
+        f.write(f'lum38={lum38v}\n')
         f.write(f'nangtoview={nangtoview}\n')  # Add this line to the summary .dat file
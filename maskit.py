@@ -53,3 +53,56 @@ def maskit(nprof, nang, xv2, yv2, zv2):
                 iplot[i2, j2] = 0  # Mask solitary points
 
     return iplot
+
+
+def maskit_sorted(nprof, nang, xv2, yv2, zv2):
+    """
+    Same mask as maskit, but the points are kept sorted in y so every box search only looks at the
+    points inside its y range instead of the whole disk. The sort order and the sorted y values are
+    held in memory (two arrays of the size of the disk); the z values of the candidates of every box
+    are read from the (possibly memory-mapped) coordinates.
+
+    Args:
+    nprof (int): Number of profile points.
+    nang (int): Number of angular points.
+    xv2, yv2, zv2 (numpy.array): Coordinates of points on the disk.
+
+    Returns:
+    numpy.array: Mask array indicating visible (1) or occluded (0) status for each point.
+    """
+    bdone = np.zeros(nang * nprof, dtype=bool)
+    iplot = np.ones((nang, nprof), dtype=np.int8)
+
+    # Points ordered by y, for the y range of every box (ravel of a contiguous memmap is a view)
+    yflat = np.asarray(yv2).ravel()
+    zflat = np.asarray(zv2).ravel()
+    order = np.argsort(yflat, kind='stable')
+    ysorted = yflat[order]
+
+    for j1 in range(nprof):
+        for i1 in range(nang):
+            if bdone[i1 * nprof + j1]:
+                continue  # Skip already processed points
+
+            ixnds = [i1 - 1 if i1 > 0 else nang - 1, (i1 + 1) % nang]
+
+            # Calculate center points for visibility determination
+            cy = (yv2[ixnds, j1] + yv2[i1, j1]) / 2
+            cz = (zv2[ixnds, j1] + zv2[i1, j1]) / 2
+
+            # Points inside the box that have not been processed yet
+            lo = np.searchsorted(ysorted, np.min(cy), side='left')
+            hi = np.searchsorted(ysorted, np.max(cy), side='right')
+            cand = order[lo:hi]
+            zc = zflat[cand]
+            visible = cand[(~bdone[cand]) & (zc >= np.min(cz)) & (zc <= np.max(cz))]
+
+            bdone[visible] = True  # Mark these points as processed
+            iplot.ravel()[visible] = 0  # Mark these points as not visible
+
+    # Final pass to clean up any solitary visible points, all rows at once
+    for j2 in range(1, nprof - 1):
+        solitary = iplot[:, j2 - 1] + iplot[:, j2 + 1] == 0
+        iplot[solitary, j2] = 0
+
+    return iplot.astype(int)
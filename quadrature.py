@@ -0,0 +1,74 @@
+"""
+Quadrature rules on [0, 1] for integrating over the disk in phase and fractional radius.
+
+The weights depend only on the mesh, so they are computed once per disk and then multiply the
+solid angle element at every node. These are alternative rules to the midpoint cells, not more
+accurate ones: the lit side of the disk ends in a step that runs across the nodes, so every rule
+converges only at first order in the node spacing.
+"""
+import numpy as np
+
+
+def simpson_weights(n, periodic=False):
+    """
+    Composite Simpson weights on n equally spaced nodes.
+
+    Non-periodic nodes include both ends of [0, 1]; with an odd number of intervals the last three
+    intervals use Simpson's 3/8 rule. Periodic nodes are k / n and get the periodic trapezoid rule
+    (equal weights).
+
+    :param n: Number of nodes
+    :param periodic: Whether the integrand is periodic on [0, 1]
+    :return: Weights, shape (n,)
+    """
+    if periodic:
+        return np.full(n, 1.0 / n)
+
+    if n == 2:
+        return np.array([0.5, 0.5])
+
+    h = 1.0 / (n - 1)
+
+    w = np.zeros(n)
+    nsimp = n if (n - 1) % 2 == 0 else n - 3
+    if nsimp >= 3:
+        w[:nsimp] += h / 3 * np.where(np.arange(nsimp) % 2, 4.0, 2.0)
+        w[0] -= h / 3
+        w[nsimp - 1] -= h / 3
+    if nsimp != n:
+        w[n - 4:] += 3 * h / 8 * np.array([1.0, 3.0, 3.0, 1.0])
+    return w
+
+
+def gauss_legendre(n):
+    """
+    Gauss-Legendre nodes and weights on [0, 1].
+
+    :param n: Number of nodes
+    :return: nodes, weights, each of shape (n,)
+    """
+    x, w = np.polynomial.legendre.leggauss(n)
+    return (x + 1) / 2, w / 2
+
+
+def disk_quadrature(kind, npoints, nprof):
+    """
+    Mesh and weights of a quadrature rule over the disk.
+
+    :param kind: 'simpson' or 'gauss'
+    :param npoints: Number of nodes in phase
+    :param nprof: Number of nodes along the profile
+    :return: mesh (ph, rfrac) for DiskGeometry, or None for the usual uniform grid, and the
+             weights (wph, wr) in units of phase and of fractional radius
+    """
+    # par.npz stores the sizes as 0-d arrays, which leggauss does not accept as a degree
+    npoints, nprof = int(npoints), int(nprof)
+    if kind == 'simpson':
+        return None, (simpson_weights(npoints, periodic=True), simpson_weights(nprof))
+    if kind == 'gauss':
+        # The disk is periodic in phase, so the phase nodes stay equally spaced (and off ph = 0.5, where
+        # the observer's view divides by sin(2 pi ph)); Gauss-Legendre nodes are used only in radius
+        ph = np.linspace(0, 1, npoints, endpoint=False) + 0.0001
+        rfrac, wr = gauss_legendre(nprof)
+        return (ph, rfrac), (simpson_weights(npoints, periodic=True), wr)
+    raise ValueError(f"Unknown quadrature '{kind}', use 'midpoint', 'simpson' or 'gauss'")
@@ -0,0 +1,65 @@
+"""
+Equal-area pixelisation of the sky around the neutron star for beam patterns.
+
+Pixels lie on rings of constant latitude. Every ring holds about 2 nring cos(latitude) pixels, so pixels
+are nearly square, and the ring edges are placed in z = sin(latitude) so that every pixel covers exactly
+4 pi / npix steradians. The pixel of a direction follows from a search over the ring edges and a division
+in longitude. Directions are (latitude, longitude) as in beam_luminosity.
+"""
+import numpy as np
+from beam import beam_pattern_at
+
+
+class EqualAreaGrid:
+    """Equal-area iso-latitude sky grid with nring rings."""
+
+    def __init__(self, nring):
+        self.nring = int(nring)
+
+        # Pixels per ring from the centre latitude of equally spaced rings
+        lat_ring = -np.pi / 2 + (np.arange(self.nring) + 0.5) * np.pi / self.nring
+        self.nphi = np.maximum(4, np.round(2 * self.nring * np.cos(lat_ring))).astype(int)
+        self.start = np.concatenate([[0], np.cumsum(self.nphi)])
+        self.npix = int(self.start[-1])
+        self.pixel_area = 4 * np.pi / self.npix
+
+        # Ring edges in z with an area proportional to the number of pixels of the ring
+        self.zedge = -1 + 2 * self.start / self.npix
+
+        # Pixel centres
+        ring = np.repeat(np.arange(self.nring), self.nphi)
+        j = np.arange(self.npix) - self.start[ring]
+        self.lat = np.arcsin((self.zedge[ring] + self.zedge[ring + 1]) / 2)
+        self.lon = 2 * np.pi * (j + 0.5) / self.nphi[ring]
+
+    def pixel(self, lat, lon):
+        """
+        Pixels containing the directions.
+        :param lat: Latitudes
+        :param lon: Longitudes, broadcastable against lat
+        :return: Pixel indices
+        """
+        lat, lon = np.broadcast_arrays(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float))
+        ring = np.clip(np.searchsorted(self.zedge, np.sin(lat), side='right') - 1, 0, self.nring - 1)
+        nphi = self.nphi[ring]
+        j = np.minimum((np.mod(lon, 2 * np.pi) / (2 * np.pi) * nphi).astype(int), nphi - 1)
+        return self.start[ring] + j
+
+    def lookup(self, values, lat, lon):
+        """Values of a pixel map (..., npix) in the pixels of the directions."""
+        return values[..., self.pixel(lat, lon)]
+
+    def luminosity(self, beams, floor, star_rot_angs):
+        """
+        Normalized beam patterns on the pixels, as beam_luminosity_all does on the equiangular grid.
+        :param beams: BeamSet, or list of Beam objects or beam parameter dictionaries
+        :param floor: Minimum value of the beam pattern
+        :param star_rot_angs: Rotational angles of the star, shape (nang,)
+        :return: Normalized luminosity patterns, shape (nang, npix)
+        """
+        return self.normalize(beam_pattern_at(self.lat, self.lon, beams, floor, star_rot_angs))
+
+    def normalize(self, beam_pattern):
+        """Patterns sampled at the pixel centres, (nang, npix), divided by their integral over the pixels."""
+        beamint = np.sum(beam_pattern, axis=1) * self.pixel_area
+        return beam_pattern / beamint[:, None]
@@ -0,0 +1,53 @@
+"""End-to-end runs of disktempsave and diskspecrest with the quadrature rules."""
+import os
+import numpy as np
+import pytest
+from diskgeometry import DiskGeometry
+from disktempsave import disktempsave
+from diskspecrest import diskspecrest
+
+
+def write_params(bdir, npoints=24, nprof=16, **settings):
+    """par.npz of a small disk heated by two beams, as written by input_parameters."""
+    params = dict(rin=0.8, rout=1.0, tiltin=np.radians(5.), tiltout=np.radians(30.), phsoff=np.radians(139.),
+                  npoints=np.array(npoints), nprof=np.array(nprof), nth=24, nphi=24, nang=2, floor=0.1,
+                  rinphys=1e8, lum38=3.0, obselev=np.radians(-5.),
+                  ph=np.linspace(0, 1, npoints, endpoint=False) + 0.0001, nangtoview=2, **settings)
+    for b, (long, lat, sigma) in enumerate([(0., 0., np.pi / 10), (np.pi, np.pi / 3, np.pi / 2)]):
+        params.update({f'beam_{b + 1}_long': long, f'beam_{b + 1}_lat': lat, f'beam_{b + 1}_sigma': sigma,
+                       f'beam_{b + 1}_th': 0., f'beam_{b + 1}_norm': 3.})
+    np.savez(os.path.join(bdir, 'par.npz'), **params)
+
+
+def run(bdir, **settings):
+    os.makedirs(bdir)
+    write_params(bdir, **settings)
+    disktempsave(bdir)
+    diskspecrest(bdir)
+    return np.load(os.path.join(bdir, 'lemit.npz'))['lemitv']
+
+
+@pytest.mark.parametrize('quadrature', ['simpson', 'gauss'])
+@pytest.mark.parametrize('npoints', [24, 25])
+def test_pipeline_quadrature(tmp_path, quadrature, npoints):
+    lemitv = run(str(tmp_path / 'midpoint'), npoints=npoints)
+    lemitv_rule = run(str(tmp_path / quadrature), npoints=npoints, quadrature=quadrature)
+
+    # Same disk, so the emitted luminosities agree to the discretization error
+    assert np.all(np.isfinite(lemitv_rule))
+    np.testing.assert_allclose(lemitv_rule, lemitv, rtol=0.1)
+    # Only a few nodes are visible on this small disk, so the profiles agree only in scale; a node at
+    # ph = 0.5, where the observer's view divides by sin(2 pi ph), overshoots them by orders of magnitude
+    for view in ('diskphi_0.000', 'diskphi_0.500'):
+        inrep, inrep_rule = (np.load(str(tmp_path / run_dir / view / 'inprof.npz'))['inrep']
+                             for run_dir in ('midpoint', quadrature))
+        assert np.all(inrep_rule < 2 * inrep.max())
+
+
+@pytest.mark.parametrize('npoints', [24, 25])
+def test_gauss_phases(npoints):
+    # The disk is periodic in phase, so only the radial nodes are Gauss-Legendre nodes
+    disk_parameters = [0.8, 1.0, np.radians(5.), np.radians(30.), np.radians(139.)]
+    geometry = DiskGeometry(np.array(npoints), np.array(16), disk_parameters, quadrature='gauss')
+    np.testing.assert_allclose(geometry.ph, np.linspace(0, 1, npoints, endpoint=False) + 0.0001)
+    np.testing.assert_allclose(geometry.weights[0], 1 / npoints)
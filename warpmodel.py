@@ -0,0 +1,188 @@
+"""
+Warp profiles of the disk: tilt(r) and twist(r) between rin and rout.
+
+Every model is vectorized in r. Parameters may be arrays of shape (nbatch, 1) to describe a stack of
+disks at once (radii then have shape (nbatch, nprof)). Models that do not supply derivatives get them
+by central differences.
+"""
+from abc import ABC, abstractmethod
+import numpy as np
+
+
+class WarpModel(ABC):
+    """Base class for warp profiles. Subclasses define tilt(r) and twist(r)."""
+
+    # Step used for the numerical derivatives
+    eps = 1e-6
+
+    @abstractmethod
+    def tilt(self, r):
+        """Tilt angle at radius r."""
+
+    @abstractmethod
+    def twist(self, r):
+        """Twist (phase offset) at radius r."""
+
+    def dtilt(self, r):
+        return (self.tilt(r + self.eps) - self.tilt(r - self.eps)) / (2 * self.eps)
+
+    def dtwist(self, r):
+        return (self.twist(r + self.eps) - self.twist(r - self.eps)) / (2 * self.eps)
+
+
+class LinearWarp(WarpModel):
+    """Tilt and twist linear in radius, as in diskshape."""
+
+    def __init__(self, rin, rout, tiltin, tiltout, phsoff):
+        self.rin = rin
+        self.rout = rout
+        self.tiltin = tiltin
+        self.tiltout = tiltout
+        self.phsoff = phsoff
+
+    def x(self, r):
+        return (r - self.rin) / (self.rout - self.rin)
+
+    def tilt(self, r):
+        return self.tiltin + (self.tiltout - self.tiltin) * self.x(r)
+
+    def twist(self, r):
+        return self.phsoff * self.x(r)
+
+    def dtilt(self, r):
+        return np.broadcast_to((self.tiltout - self.tiltin) / (self.rout - self.rin), np.shape(r))
+
+    def dtwist(self, r):
+        return np.broadcast_to(self.phsoff / (self.rout - self.rin), np.shape(r))
+
+
+class PowerLawWarp(LinearWarp):
+    """
+    Tilt and twist growing as a power of the fractional radius x = (r - rin) / (rout - rin),
+    from tiltin to tiltout and from 0 to phsoff.
+    """
+
+    def __init__(self, rin, rout, tiltin, tiltout, phsoff, tiltindex=1.0, twistindex=1.0):
+        super().__init__(rin, rout, tiltin, tiltout, phsoff)
+        self.tiltindex = tiltindex
+        self.twistindex = twistindex
+
+    def tilt(self, r):
+        return self.tiltin + (self.tiltout - self.tiltin) * self.x(r)**self.tiltindex
+
+    def twist(self, r):
+        return self.phsoff * self.x(r)**self.twistindex
+
+    def dtilt(self, r):
+        x = np.maximum(self.x(r), 1e-12)
+        return (self.tiltout - self.tiltin) * self.tiltindex * x**(self.tiltindex - 1) / (self.rout - self.rin)
+
+    def dtwist(self, r):
+        x = np.maximum(self.x(r), 1e-12)
+        return self.phsoff * self.twistindex * x**(self.twistindex - 1) / (self.rout - self.rin)
+
+
+class TanhWarp(LinearWarp):
+    """
+    Tilt and twist switching from their inner to their outer values around rmid over a width,
+    following (1 + tanh((r - rmid) / width)) / 2.
+    """
+
+    def __init__(self, rin, rout, tiltin, tiltout, phsoff, rmid=None, width=None):
+        super().__init__(rin, rout, tiltin, tiltout, phsoff)
+        self.rmid = (rin + rout) / 2 if rmid is None else rmid
+        self.width = (rout - rin) / 10 if width is None else width
+
+    def s(self, r):
+        return (1 + np.tanh((r - self.rmid) / self.width)) / 2
+
+    def ds(self, r):
+        return 1 / (2 * self.width * np.cosh((r - self.rmid) / self.width)**2)
+
+    def tilt(self, r):
+        return self.tiltin + (self.tiltout - self.tiltin) * self.s(r)
+
+    def twist(self, r):
+        return self.phsoff * self.s(r)
+
+    def dtilt(self, r):
+        return (self.tiltout - self.tiltin) * self.ds(r)
+
+    def dtwist(self, r):
+        return self.phsoff * self.ds(r)
+
+
+class TabulatedWarp(WarpModel):
+    """Tilt and twist interpolated linearly from a table, e.g. from a hydrodynamical simulation."""
+
+    def __init__(self, r, tilt, twist):
+        self.r = np.asarray(r, dtype=float)
+        self.tilt_table = np.asarray(tilt, dtype=float)
+        self.twist_table = np.asarray(twist, dtype=float)
+        self.dtilt_table = np.gradient(self.tilt_table, self.r)
+        self.dtwist_table = np.gradient(self.twist_table, self.r)
+
+    def tilt(self, r):
+        return np.interp(r, self.r, self.tilt_table)
+
+    def twist(self, r):
+        return np.interp(r, self.r, self.twist_table)
+
+    def dtilt(self, r):
+        return np.interp(r, self.r, self.dtilt_table)
+
+    def dtwist(self, r):
+        return np.interp(r, self.r, self.dtwist_table)
+
+
+# Models that can be selected with the 'warp' key of par.npz
+WARP_MODELS = {
+    'linear': LinearWarp,
+    'powerlaw': PowerLawWarp,
+    'tanh': TanhWarp,
+    'tabulated': TabulatedWarp,
+}
+
+
+def warp_from_params(params):
+    """
+    Build the warp model described by the contents of a par.npz file.
+
+    The model is named by 'warp' and its extra parameters are read from the 'warp_<name>' keys.
+    A tabulated warp reads r, tilt and twist from the .npz file given by 'warp_table'.
+
+    :param params: Loaded par.npz (or any mapping with the same keys)
+    :return: WarpModel, or None for the default linear warp of diskshape
+    """
+    name = str(params['warp']) if 'warp' in params else 'linear'
+    if name == 'linear':
+        return None
+
+    if name == 'tabulated':
+        table = np.load(str(params['warp_table']))
+        return TabulatedWarp(table['r'], table['tilt'], table['twist'])
+
+    kwargs = {key[len('warp_'):]: float(params[key]) for key in params if key.startswith('warp_')}
+    return WARP_MODELS[name](float(params['rin']), float(params['rout']), float(params['tiltin']),
+                             float(params['tiltout']), float(params['phsoff']), **kwargs)
+
+
+def warp_profiles(disk_parameters_v, rfrac, warp=None):
+    """
+    Radii, tilt and twist along the profile with their radial derivatives.
+
+    :param disk_parameters_v: [rin, rout, tiltin, tiltout, phsoff], or an (nbatch, 5) stack of them
+    :param rfrac: Fractional radii of the profile points (0 at rin, 1 at rout)
+    :param warp: WarpModel to use; the linear warp of the disk parameters if None
+    :return: rv, tilt, dtilt, off, doff, each of shape (nbatch, nprof)
+    """
+    disk_parameters_v = np.atleast_2d(np.asarray(disk_parameters_v, dtype=float))
+    rin, rout, tiltin, tiltout, phsoff = disk_parameters_v.T[:, :, None]
+    if warp is None:
+        warp = LinearWarp(rin, rout, tiltin, tiltout, phsoff)
+
+    rv = rin + (rout - rin) * np.asarray(rfrac)[None, :]
+    shape = rv.shape
+
+    return (rv, np.broadcast_to(warp.tilt(rv), shape), np.broadcast_to(warp.dtilt(rv), shape),
+            np.broadcast_to(warp.twist(rv), shape), np.broadcast_to(warp.dtwist(rv), shape))